@@ -0,0 +1,3 @@
+"""
+Command line maintenance tools, run with python -m app.cli.<name>
+"""
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Rebuild the hourly/daily usage rollups from the raw usage_logs.
+
+    python -m app.cli.backfill_rollups [--start 2025-01-01] [--end 2025-02-01]
+
+The range is widened to whole UTC days and every bucket in it is
+recomputed server-side ($dateTrunc + $merge, MongoDB 5.0+) and replaces
+the existing rollup document, so the command can be re-run safely.
+"""
+import argparse
+import asyncio
+from datetime import timedelta
+from app import database
+from app.models.usage_log_model import get_usage_log_collection
+from app.services.usage_rollups import GRANULARITIES, bucket_start
+from app.utils.time_utils import parse_utc, utcnow
+
+
+def backfill_pipeline(start, end, granularity: str):
+    bucket = {"$dateTrunc": {"date": "$timestamp", "unit": granularity}}
+    return [
+        {"$match": {"timestamp": {"$gte": start, "$lt": end, "$type": "date"}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            # Same field order as usage_rollups.rollup_key
+            "_id": {
+                "granularity": granularity,
+                "bucket": bucket,
+                "action": "$action",
+                "user_id": "$user_id",
+                "license_id": "$license_id",
+            },
+            "count": {"$sum": 1},
+            "total_duration": {"$sum": {"$ifNull": ["$duration_seconds", 0]}},
+            "user_name": {"$last": "$user_name"},
+            "license_no": {"$last": "$license_no"},
+        }},
+        {"$set": {
+            "granularity": "$_id.granularity",
+            "bucket": "$_id.bucket",
+            "action": "$_id.action",
+            "user_id": "$_id.user_id",
+            "license_id": "$_id.license_id",
+        }},
+        {"$merge": {"into": "usage_rollups", "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+async def main(start_date, end_date):
+    database.connect()
+    try:
+        end = parse_utc(end_date) if end_date else utcnow()
+        start = parse_utc(start_date) if start_date else None
+        if start is None:
+            first = await get_usage_log_collection().find_one(
+                {"timestamp": {"$type": "date"}}, {"timestamp": 1}, sort=[("timestamp", 1)]
+            )
+            if first is None:
+                print("No usage logs to roll up")
+                return
+            start = first["timestamp"]
+
+        start = bucket_start(start, "day")
+        end = bucket_start(end, "day") + timedelta(days=1)
+        for granularity in GRANULARITIES:
+            await (await get_usage_log_collection().aggregate(
+                backfill_pipeline(start, end, granularity), allowDiskUse=True
+            )).to_list()
+            print(f"{granularity} rollups rebuilt for {start:%Y-%m-%d} to {end:%Y-%m-%d}")
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild usage rollups from raw usage logs")
+    parser.add_argument("--start", help="ISO date; defaults to the oldest log")
+    parser.add_argument("--end", help="ISO date; defaults to now")
+    args = parser.parse_args()
+    asyncio.run(main(args.start, args.end))
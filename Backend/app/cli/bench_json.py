@@ -0,0 +1,91 @@
+"""
+Compare response encoding for the large list endpoints.
+
+    python -m app.cli.bench_json [--docs 5000] [--rounds 20]
+
+"before" is the previous path: stringify _id in a Python loop, then
+FastAPI's jsonable_encoder and JSONResponse's json.dumps. "after" is
+MongoJSONResponse encoding the BSON-decoded documents directly. Documents
+are synthetic but shaped like all_licenses, usage_logs and users.
+"""
+import argparse
+import json
+import time
+from datetime import timedelta
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from app.utils.json_response import dumps
+from app.utils.time_utils import utcnow
+
+
+def license_doc(n: int, now):
+    return {
+        "_id": ObjectId(), "No": str(n), "username": f"user{n}", "gmail": f"license{n}@gmail.com",
+        "is_available": n % 3 != 0, "current_user": str(ObjectId()), "current_user_name": "Somchai Jaidee",
+        "assigned_at": now, "expires_at": now + timedelta(hours=1), "reserved_by": None,
+        "reserved_by_name": None, "reserved_at": None, "reservation_expires_at": None,
+        "last_activity": now, "queue_count": 0, "seq": n
+    }
+
+
+def usage_log_doc(n: int, now):
+    return {
+        "_id": ObjectId(), "timestamp": now - timedelta(seconds=n), "user_id": str(ObjectId()),
+        "user_name": "Somchai Jaidee", "license_id": str(ObjectId()), "license_no": str(n % 50),
+        "action": "activate", "duration_seconds": 3600, "ip_address": "10.0.0.1",
+        "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
+    }
+
+
+def user_doc(n: int, now):
+    return {
+        "_id": ObjectId(), "first_name": "Somchai", "last_name": f"Jaidee{n}",
+        "email": f"user{n}@cyberpolice.go.th", "phone_number": f"08{n:08d}", "role": "user",
+        "created_at": now
+    }
+
+
+def encode_before(docs: list, key: str):
+    for doc in docs:
+        if key == "users":
+            doc["user_id"] = str(doc.pop("_id"))
+        else:
+            doc["_id"] = str(doc["_id"])
+    return json.dumps(
+        jsonable_encoder({key: docs}), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encode_after(docs: list, key: str):
+    return dumps({key: docs})
+
+
+def best_of(encode, make_docs, key: str, rounds: int):
+    best = float("inf")
+    for _ in range(rounds):
+        # Fresh documents every round: the old path rewrites them in place
+        docs = make_docs()
+        started = time.perf_counter()
+        encode(docs, key)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(count: int, rounds: int):
+    now = utcnow()
+    cases = [("licensess", license_doc), ("logs", usage_log_doc), ("users", user_doc)]
+    print(f"{count} documents, best of {rounds} rounds, ms per 1k documents")
+    print(f"{'endpoint':<12}{'before':>10}{'after':>10}{'speedup':>10}")
+    for key, factory in cases:
+        make_docs = lambda: [factory(n, now) for n in range(count)]
+        before = best_of(encode_before, make_docs, key, rounds) * 1000 / count * 1000
+        after = best_of(encode_after, make_docs, key, rounds) * 1000 / count * 1000
+        print(f"{key:<12}{before:>10.2f}{after:>10.2f}{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON encoding of the list endpoints")
+    parser.add_argument("--docs", type=int, default=5000, help="documents per response")
+    parser.add_argument("--rounds", type=int, default=20, help="timed rounds per case; the best is reported")
+    args = parser.parse_args()
+    main(args.docs, args.rounds)
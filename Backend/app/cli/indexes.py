@@ -0,0 +1,52 @@
+"""
+Report declared indexes that are missing and existing indexes that are unused.
+
+    python -m app.cli.indexes [--apply]
+
+Usage counts come from $indexStats and reset when the mongod restarts,
+so an index reported as unused has not been used since then.
+"""
+import argparse
+import asyncio
+from app import database
+from app.models.indexes import INDEXES, ensure_indexes
+
+
+async def report(db):
+    for collection_name, indexes in INDEXES.items():
+        declared = {index.document["name"] for index in indexes}
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        stats = await (await collection.aggregate([{"$indexStats": {}}])).to_list()
+        usage = {stat["name"]: stat["accesses"] for stat in stats}
+
+        print(f"[{collection_name}]")
+        for name in sorted(declared - set(existing)):
+            print(f"  MISSING    {name}")
+        for name in sorted(existing):
+            if name == "_id_":
+                continue
+            accesses = usage.get(name, {})
+            ops = accesses.get("ops", 0)
+            status = "UNUSED   " if ops == 0 else "ok       "
+            origin = "" if name in declared else " (not declared)"
+            since = accesses.get("since")
+            print(f"  {status}  {name}: {ops} ops since {since}{origin}")
+
+
+async def main(apply: bool):
+    database.connect()
+    try:
+        db = database.get_db()
+        if apply:
+            await ensure_indexes(db)
+        await report(db)
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report missing and unused MongoDB indexes")
+    parser.add_argument("--apply", action="store_true", help="create missing indexes before reporting")
+    args = parser.parse_args()
+    asyncio.run(main(args.apply))
@@ -0,0 +1,112 @@
+"""
+Convert legacy ISO-string timestamps to native BSON dates.
+
+    python -m app.cli.migrate_datetimes [--batch-size 500] [--dry-run] [--restart]
+
+Safe to run while the API is serving traffic: documents are converted in
+_id order, one bulk_write per batch, and the last processed _id is stored
+in the `migrations` collection so an interrupted run resumes where it
+stopped. Values that cannot be parsed are left untouched and counted.
+"""
+import argparse
+import asyncio
+from pymongo import UpdateOne
+from app import database
+from app.utils.time_utils import parse_utc, utcnow
+
+MIGRATION_ID = "datetime_fields_v1"
+
+DATETIME_FIELDS = {
+    "all_licenses": [
+        "reserved_at",
+        "reservation_expires_at",
+        "assigned_at",
+        "expires_at",
+        "last_activity",
+    ],
+    "usage_logs": ["timestamp"],
+}
+
+
+async def migrate_collection(db, collection_name: str, fields: list, batch_size: int, dry_run: bool, restart: bool):
+    checkpoints = db["migrations"]
+    checkpoint_id = f"{MIGRATION_ID}:{collection_name}"
+    if restart and not dry_run:
+        await checkpoints.delete_one({"_id": checkpoint_id})
+
+    checkpoint = await checkpoints.find_one({"_id": checkpoint_id}) or {}
+    if checkpoint.get("completed_at"):
+        print(f"{collection_name}: already migrated at {checkpoint['completed_at']}")
+        return
+
+    last_id = checkpoint.get("last_id")
+    converted = checkpoint.get("converted", 0)
+    failed = checkpoint.get("failed", 0)
+    collection = db[collection_name]
+    string_filter = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+
+    while True:
+        query = dict(string_filter)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await collection.find(query, projection).sort("_id", 1).limit(batch_size).to_list()
+        if not batch:
+            break
+
+        operations = []
+        for document in batch:
+            update = {}
+            for field in fields:
+                value = document.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    update[field] = parse_utc(value)
+                except ValueError:
+                    failed += 1
+            if update:
+                # Only overwrite values that are still the strings we read
+                operations.append(UpdateOne(
+                    {"_id": document["_id"], **{field: document[field] for field in update}},
+                    {"$set": update}
+                ))
+                converted += len(update)
+
+        last_id = batch[-1]["_id"]
+        if not dry_run:
+            if operations:
+                await collection.bulk_write(operations, ordered=False)
+            await checkpoints.update_one(
+                {"_id": checkpoint_id},
+                {"$set": {"last_id": last_id, "converted": converted, "failed": failed, "updated_at": utcnow()}},
+                upsert=True
+            )
+        print(f"{collection_name}: {converted} values converted, {failed} unparseable (up to _id {last_id})")
+
+    if not dry_run:
+        await checkpoints.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"completed_at": utcnow(), "converted": converted, "failed": failed}},
+            upsert=True
+        )
+    print(f"{collection_name}: done, {converted} values converted, {failed} unparseable")
+
+
+async def main(batch_size: int, dry_run: bool, restart: bool):
+    database.connect()
+    try:
+        db = database.get_db()
+        for collection_name, fields in DATETIME_FIELDS.items():
+            await migrate_collection(db, collection_name, fields, batch_size, dry_run, restart)
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to BSON dates")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run, args.restart))
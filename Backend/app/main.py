@@ -1,8 +1,44 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from app import database
 from app.routes import licenses_routes, otp_routes, auth_routes, usage_log_routes
+from app.models.indexes import ensure_indexes
+from app.services.expiry_scheduler import expiry_scheduler
+from app.services.imap_pool import imap_pool
+from app.services.license_changes import license_seq
+from app.services.license_events import license_events
+from app.services.license_snapshot import license_snapshot
+from app.services.log_sink import usage_log_sink
+from app.services.mail_accounts import mail_accounts
+from app.services.otp_watcher import otp_watchers
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.connect()
+    await ensure_indexes(database.get_db())
+    await license_seq.start()
+    await usage_log_sink.start()
+    await license_events.start()
+    await license_snapshot.start()
+    await expiry_scheduler.start()
+    await imap_pool.start()
+    await mail_accounts.start()
+    await otp_watchers.start(mail_accounts.accounts())
+    try:
+        yield
+    finally:
+        await otp_watchers.stop()
+        await mail_accounts.stop()
+        await imap_pool.stop()
+        await expiry_scheduler.stop()
+        await license_snapshot.stop()
+        await license_events.stop()
+        await usage_log_sink.stop()
+        await license_seq.stop()
+        await database.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -17,3 +53,7 @@ app.include_router(licenses_routes.router)
 app.include_router(otp_routes.router)
 app.include_router(auth_routes.router)
 app.include_router(usage_log_routes.router)
+
+@app.get("/health/db", tags=["Health"])
+def get_db_health():
+    return database.get_pool_stats()
@@ -0,0 +1,59 @@
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.collation import Collation
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# License numbers are strings; compare them as numbers ("2" < "10")
+NUMERIC_COLLATION = Collation(locale="en", numericOrdering=True)
+
+# Every index the API relies on, per collection. Names are explicit so the
+# report CLI can match declared indexes against what the server has.
+INDEXES = {
+    "users": [
+        IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "all_licenses": [
+        IndexModel([("gmail", ASCENDING)], name="gmail_unique", unique=True),
+        IndexModel([("reserved_by", ASCENDING), ("is_available", ASCENDING)], name="reserved_by_is_available"),
+        IndexModel([("is_available", ASCENDING), ("expires_at", ASCENDING)], name="is_available_expires_at"),
+        IndexModel([("reservation_expires_at", ASCENDING)], name="reservation_expires_at"),
+        IndexModel([("seq", ASCENDING)], name="seq"),
+        # Lean listing keyset: sorted by No, _id as tiebreaker, under NUMERIC_COLLATION
+        IndexModel([("No", ASCENDING), ("_id", ASCENDING)], name="no_id", collation=NUMERIC_COLLATION),
+    ],
+    "license_tombstones": [
+        IndexModel([("seq", ASCENDING)], name="seq"),
+    ],
+    "usage_logs": [
+        # Keyset pagination sorts on (timestamp, _id), so _id is part of each key
+        IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp_id"),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="user_id_timestamp_id"),
+        IndexModel([("license_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="license_id_timestamp_id"),
+        IndexModel([("action", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="action_timestamp_id"),
+    ],
+    "usage_rollups": [
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_bucket"),
+    ],
+}
+
+
+async def ensure_indexes(db):
+    """
+    Create any declared index that is missing. create_index is a no-op for
+    an index that already exists with the same spec, so this is safe to run
+    on every startup. Failures (e.g. duplicates blocking a unique index)
+    are logged instead of stopping the app.
+    """
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except ConnectionFailure as e:
+                logger.warning("Skipping index check, database unreachable: %s", e)
+                return
+            except PyMongoError as e:
+                logger.warning("Could not create index %s on %s: %s",
+                               index.document["name"], collection_name, e)
@@ -1,3 +1,10 @@
+from app.database import get_db
+
 def licenses_collection():
-    from app.database import db
-    return db["all_licenses"]
+    return get_db()["all_licenses"]
+
+def license_tombstones_collection():
+    return get_db()["license_tombstones"]
+
+def counters_collection():
+    return get_db()["counters"]
\ No newline at end of file
@@ -1,13 +1,4 @@
-import os
-from pymongo import MongoClient
-from dotenv import load_dotenv
-
-load_dotenv()
-
-MONGODB_URI = os.getenv("MONGODB_URI")
-DB_NAME = os.getenv("DB_NAME")
+from app.database import get_db
 
 def get_usage_log_collection():
-    client = MongoClient(MONGODB_URI)
-    db = client[DB_NAME]
-    return db["usage_logs"]
+    return get_db()["usage_logs"]
\ No newline at end of file
@@ -2,25 +2,26 @@ from fastapi import APIRouter, HTTPException, Depends
 from app.schemas.auth_schema import RegisterUser, LoginUser, UpdateUser
 from app.models.auth_model import get_user_collection
 from app.utils.jwt_handler import create_access_token
+from app.utils.json_response import MongoJSONResponse
 from fastapi.responses import JSONResponse
-from app.dependencies.auth import get_current_user, require_admin
+from app.dependencies.auth import get_current_user, require_admin, invalidate_principal, invalidate_user
 from datetime import datetime
 from bson import ObjectId
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
 @router.post("/register")
-def register_user(user: RegisterUser):
+async def register_user(user: RegisterUser):
     user_collection = get_user_collection()
 
     allowed_domains = ["@cyberpolice.go.th"]
     if not any(user.email.lower().endswith(domain) for domain in allowed_domains):
         raise HTTPException(status_code=400, detail="Email must be @cyberpolice.go.th")
 
-    if user_collection.find_one({"phone_number": user.phone_number}):
+    if await user_collection.find_one({"phone_number": user.phone_number}):
         raise HTTPException(status_code=400, detail="Phone number already registered")
     
-    if user_collection.find_one({"email": user.email}):
+    if await user_collection.find_one({"email": user.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
 
     user_data = user.dict()
@@ -29,13 +30,13 @@ def register_user(user: RegisterUser):
     user_data["is_active"] = True
     user_data["last_login"] = None
     
-    user_collection.insert_one(user_data)
+    await user_collection.insert_one(user_data)
     return {"message": "User registered successfully"}
 
 @router.post("/login")
-def login(user: LoginUser):
+async def login(user: LoginUser):
     user_collection = get_user_collection()
-    user_data = user_collection.find_one({"phone_number": user.phone_number})
+    user_data = await user_collection.find_one({"phone_number": user.phone_number})
     
     if not user_data or user_data["password"] != user.password:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -43,45 +44,36 @@ def login(user: LoginUser):
     if not user_data.get("is_active", True):
         raise HTTPException(status_code=401, detail="Account is deactivated")
 
-    user_collection.update_one(
+    await user_collection.update_one(
         {"_id": user_data["_id"]},
         {"$set": {"last_login": datetime.utcnow().isoformat() + "Z"}}
     )
+    invalidate_principal(user.phone_number)
 
     token = create_access_token({"phone_number": user.phone_number})
     return {"access_token": token, "token_type": "bearer"}
 
 @router.post("/logout")
-def logout(current_user: dict = Depends(get_current_user)):
+async def logout(current_user: dict = Depends(get_current_user)):
     return JSONResponse(content={
         "message": "Logout successful."
     })
 
 @router.get("/")
-def get_my_info(current_user: dict = Depends(get_current_user)):
-    phone_number = current_user.get("phone_number")
-    if not phone_number:
-        raise HTTPException(status_code=400, detail="Invalid token data")
-
-    user = get_user_collection().find_one({"phone_number": phone_number}, {"password": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    user["user_id"] = str(user["_id"])
-    del user["_id"]
-    
-    return user
+async def get_my_info(current_user: dict = Depends(get_current_user)):
+    return current_user
 
 @router.get("/users", dependencies=[Depends(require_admin)])
-def get_all_users(current_user: dict = Depends(get_current_user)):
-    users = list(get_user_collection().find({}, {"password": 0}))
-    for user in users:
-        user["user_id"] = str(user["_id"])
-        del user["_id"]
-    return {"users": users}
+async def get_all_users(current_user: dict = Depends(get_current_user)):
+    # Renamed server-side, so the documents go to the encoder untouched
+    cursor = await get_user_collection().aggregate([
+        {"$set": {"user_id": "$_id"}},
+        {"$unset": ["_id", "password"]}
+    ])
+    return MongoJSONResponse({"users": await cursor.to_list()})
 
 @router.put("/users/{user_id}", dependencies=[Depends(require_admin)])
-def update_user(user_id: str, user_update: UpdateUser, current_user: dict = Depends(get_current_user)):
+async def update_user(user_id: str, user_update: UpdateUser, current_user: dict = Depends(get_current_user)):
     if not ObjectId.is_valid(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
@@ -90,23 +82,25 @@ def update_user(user_id: str, user_update: UpdateUser, current_user: dict = Depe
     
     if update_data:
         update_data["updated_at"] = datetime.utcnow().isoformat() + "Z"
-        result = user_collection.update_one(
+        result = await user_collection.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": update_data}
         )
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="User not found")
+        
+        invalidate_user(user_id)
     
     return {"message": "User updated successfully"}
 
 @router.delete("/users/{user_id}", dependencies=[Depends(require_admin)])
-def deactivate_user(user_id: str, current_user: dict = Depends(get_current_user)):
+async def deactivate_user(user_id: str, current_user: dict = Depends(get_current_user)):
     if not ObjectId.is_valid(user_id):
         raise HTTPException(status_code=400, detail="Invalid user ID")
     
     user_collection = get_user_collection()
-    result = user_collection.update_one(
+    result = await user_collection.update_one(
         {"_id": ObjectId(user_id)},
         {"$set": {"is_active": False, "updated_at": datetime.utcnow().isoformat() + "Z"}}
     )
@@ -114,4 +108,6 @@ def deactivate_user(user_id: str, current_user: dict = Depends(get_current_user)
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
+    invalidate_user(user_id)
+    
     return {"message": "User deactivated successfully"}
\ No newline at end of file
@@ -1,648 +1,648 @@
-from fastapi import APIRouter, HTTPException, Path, Depends, Request
+from fastapi import APIRouter, HTTPException, Path, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from app.schemas.licenses_schema import licenses, Updatelicenses
 from app.models.licenses_model import licenses_collection
-from app.dependencies.auth import get_current_user
+from app.dependencies.auth import get_current_user, optional_oauth2_scheme
+from app.models.indexes import NUMERIC_COLLATION
 from app.routes.usage_log_routes import log_usage
+from app.services.expiry import sweep_expired
+from app.utils.time_utils import parse_utc, to_iso, utcnow
+from app.services.expiry_scheduler import expiry_scheduler
+from app.services.license_changes import changes_since, license_seq, record_deletion
+from app.services.license_events import RESET, license_events
+from app.services.license_snapshot import license_snapshot, normalize_license
+from app.services.mail_accounts import mail_accounts
+from app.utils.json_response import MongoJSONResponse
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
 from datetime import datetime, timedelta
+from typing import Literal
+import asyncio
+import base64
+import json
+import os
+
+LICENSE_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("LICENSE_EVENTS_KEEPALIVE_SECONDS", "15"))
+LICENSE_EVENTS_RETRY_MS = int(os.getenv("LICENSE_EVENTS_RETRY_MS", "3000"))
+
+# What the dashboard renders; credentials and bookkeeping fields stay in Mongo
+LEAN_PROJECTION = {
+    field: 1 for field in (
+        "No", "username", "is_available", "is_avaliable",
+        "current_user", "current_user_name", "assigned_at", "expires_at",
+        "reserved_by", "reserved_by_name", "reserved_at", "reservation_expires_at",
+        "last_activity", "queue_count", "seq"
+    )
+}
 
 router = APIRouter(prefix="/licenses", tags=["Licenses"])
 
 @router.post("/add")
-def add_licenses(licenses: licenses, user: dict = Depends(get_current_user)):
-    existing_licenses = licenses_collection().find_one({"gmail": licenses.gmail})
+async def add_licenses(licenses: licenses, user: dict = Depends(get_current_user)):
+    existing_licenses = await licenses_collection().find_one({"gmail": licenses.gmail})
     if existing_licenses:
         raise HTTPException(status_code=400, detail="licenses already exists")
 
-    licenses_collection().insert_one(licenses.dict())
+    document = licenses.dict()
+    async with license_seq.next() as seq:
+        result = await licenses_collection().insert_one({**document, "seq": seq})
+    mail_accounts.upsert({**document, "_id": result.inserted_id})
+    license_events.publish("insert", result.inserted_id, {**document, "seq": seq})
     return {"message": "licenses added successfully"}
 
 @router.delete("/delete/{licenses_id}")
-def delete_licenses(licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
+async def delete_licenses(licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    result = licenses_collection().delete_one({"_id": ObjectId(licenses_id)})
-    if result.deleted_count == 0:
+    async with license_seq.next() as seq:
+        deleted = await licenses_collection().find_one_and_delete({"_id": ObjectId(licenses_id)}, projection={"_id": 1})
+        if deleted is not None:
+            await record_deletion(deleted["_id"], seq)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="licenses not found")
+    mail_accounts.remove(deleted["_id"])
+    license_events.publish("delete", deleted["_id"])
 
     return {"message": "licenses deleted successfully"}
 
 @router.put("/edit/{licenses_id}")
-def update_licenses(licenses_id: str = Path(...), updated_licenses: Updatelicenses = ..., user: dict = Depends(get_current_user)):
+async def update_licenses(licenses_id: str = Path(...), updated_licenses: Updatelicenses = ..., user: dict = Depends(get_current_user)):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
     update_data = {k: v for k, v in updated_licenses.dict().items() if v is not None}
-    result = licenses_collection().update_one({"_id": ObjectId(licenses_id)}, {"$set": update_data})
+    async with license_seq.next() as seq:
+        updated = await licenses_collection().find_one_and_update(
+            {"_id": ObjectId(licenses_id)},
+            {"$set": {**update_data, "seq": seq}},
+            projection={"No": 1, "gmail": 1, "mail_password": 1},
+            return_document=ReturnDocument.AFTER
+        )
 
-    if result.matched_count == 0:
+    if updated is None:
         raise HTTPException(status_code=404, detail="licenses not found")
+    mail_accounts.upsert(updated)
+    license_events.publish("update", updated["_id"], {**update_data, "seq": seq})
 
     return {"message": "licenses updated successfully"}
 
+def _etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+def _not_modified(request: Request, response: Response):
+    """
+    Tag the response with the current license collection version and, if
+    the client already has it, return the 304 to send instead. The version
+    is read before the query so a write racing the read only ever makes
+    the tag older than the body, never newer.
+    """
+    etag = license_events.etag()
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if _etag_matches(request, etag):
+        # Keeps whatever the route already set, e.g. Vary
+        return Response(status_code=304, headers=dict(response.headers))
+    return None
+
 @router.get("/")
-def get_all_licensess():
-    current_time = datetime.utcnow()
-    
-    potential_expired_reservations = licenses_collection().find({
-        "is_available": True,
-        "reserved_by": {"$exists": True, "$ne": None},
-        "reservation_expires_at": {"$exists": True, "$ne": None}
+async def get_all_licensess(request: Request):
+    """Served from the in-memory snapshot; see LicenseSnapshot for freshness rules"""
+    etag = license_events.etag()
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    try:
+        body, stale = await license_snapshot.get()
+    except PyMongoError:
+        raise HTTPException(status_code=503, detail="Licenses are temporarily unavailable")
+
+    headers = {"Cache-Control": "no-cache"}
+    if stale:
+        # Untagged, so the client cannot later revalidate stale data into a 304
+        headers["X-Snapshot-Stale"] = "true"
+    else:
+        headers["ETag"] = etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def encode_license_cursor(licenses: dict):
+    payload = json.dumps({"no": licenses.get("No"), "id": str(licenses["_id"])})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_license_cursor(cursor: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return payload["no"], ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _status_filter(status: str, user: dict, current_time: datetime):
+    live_reservation = {"reserved_by": {"$ne": None}, "reservation_expires_at": {"$gte": current_time}}
+    if status == "available":
+        return {"is_available": {"$ne": False}, "$nor": [live_reservation]}
+    if status == "reserved":
+        return {"is_available": {"$ne": False}, **live_reservation}
+    if status == "in_use":
+        return {"is_available": False}
+    return {"$or": [{"current_user": user["user_id"]}, {"reserved_by": user["user_id"]}]}
+
+@router.get("/lean")
+async def get_lean_licenses(
+    request: Request,
+    response: Response,
+    status: Literal["available", "reserved", "in_use", "mine"] | None = Query(None),
+    cursor: str | None = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(100, ge=1, le=500),
+    token: str | None = Depends(optional_oauth2_scheme)
+):
+    """
+    Dashboard listing: only the fields the list view renders, optionally
+    filtered by status, sorted numerically by No and paged by keyset.
+    "mine" (licenses the caller holds or has reserved) needs a bearer token;
+    the other filters ignore any token sent.
+    """
+    user = None
+    if status == "mine":
+        if token is None:
+            raise HTTPException(status_code=401, detail="Sign in to list your licenses")
+        user = await get_current_user(token)
+
+    response.headers["Vary"] = "Authorization"
+    not_modified = _not_modified(request, response)
+    if not_modified:
+        return not_modified
+
+    clauses = []
+    if status:
+        clauses.append(_status_filter(status, user, utcnow()))
+    if cursor:
+        after_no, after_id = decode_license_cursor(cursor)
+        clauses.append({"$or": [{"No": {"$gt": after_no}}, {"No": after_no, "_id": {"$gt": after_id}}]})
+    query = {"$and": clauses} if clauses else {}
+
+    licensess = await licenses_collection().find(
+        query, LEAN_PROJECTION, collation=NUMERIC_COLLATION
+    ).sort([("No", 1), ("_id", 1)]).limit(limit + 1).to_list()
+
+    next_cursor = None
+    if len(licensess) > limit:
+        licensess = licensess[:limit]
+        next_cursor = encode_license_cursor(licensess[-1])
+
+    return MongoJSONResponse({
+        "licensess": [normalize_license(licenses) for licenses in licensess],
+        "count": len(licensess),
+        "next_cursor": next_cursor
+    }, headers=response.headers)
+
+@router.get("/snapshot-stats")
+async def get_license_snapshot_stats():
+    return {"snapshot": license_snapshot.stats(), "events": license_events.stats()}
+
+@router.get("/changes")
+async def get_license_changes(
+    since: int = Query(0, ge=0, description="The next_since value from the previous call; 0 for a full listing"),
+    limit: int = Query(500, ge=1, le=5000)
+):
+    """
+    Licenses changed and ids deleted after `since`. Pass back `next_since`
+    on the next call and repeat while `has_more` is true. since=0 returns
+    every license, including ones written before sequencing existed.
+    """
+    through = license_seq.floor()
+    if since == 0:
+        licensess = await licenses_collection().find().to_list()
+        deleted = []
+        next_since = through
+        has_more = False
+    else:
+        licensess, deleted, next_since = await changes_since(since, through, limit)
+        has_more = len(licensess) >= limit
+
+    return MongoJSONResponse({
+        "since": since,
+        "next_since": next_since,
+        "has_more": has_more,
+        "licensess": [normalize_license(licenses) for licenses in licensess],
+        "deleted": deleted
     })
-    
-    for license in potential_expired_reservations:
-        reservation_expires_at_str = license.get("reservation_expires_at")
-        if reservation_expires_at_str:
-            try:
-                reservation_expires_at = datetime.fromisoformat(reservation_expires_at_str.replace('Z', '+00:00'))
-                if reservation_expires_at.tzinfo is not None:
-                    reservation_expires_at = reservation_expires_at.replace(tzinfo=None)
-                
-                if current_time > reservation_expires_at:
-                    try:
-                        log_usage(
-                            user_id=license.get("reserved_by", "system"),
-                            user_name=license.get("reserved_by_name", "System Cleanup"),
-                            license_id=str(license["_id"]),
-                            license_no=license.get("No", ""),
-                            action="reservation_expired",
-                            ip_address=None,
-                            user_agent="Auto Cleanup"
-                        )
-                    except Exception:
-                        pass
-                    
-                    clear_data = {
-                        "reserved_by": None,
-                        "reserved_by_name": None,
-                        "reserved_at": None,
-                        "reservation_expires_at": None,
-                        "last_activity": current_time.isoformat() + "Z"
-                    }
-                    
-                    licenses_collection().update_one(
-                        {"_id": license["_id"]},
-                        {"$set": clear_data}
-                    )
-            except Exception:
-                continue
-    
-    licensess = list(licenses_collection().find())
-    for licenses in licensess:
-        licenses["_id"] = str(licenses["_id"])
-        if "is_avaliable" in licenses:
-            licenses["is_available"] = licenses.pop("is_avaliable")
-        if "is_available" not in licenses:
-            licenses["is_available"] = True
-    return {
-        "total_licensess": len(licensess),
-        "licensess": licensess
-    }
+
+@router.get("/events")
+async def stream_license_events(request: Request):
+    """
+    Server-Sent Events feed of license changes. Each `license` event carries
+    {"type": insert|update|delete, "license_id", "fields"} where fields holds
+    only what changed. A `reset` event means the client missed changes and
+    should refetch GET /licenses/. Reconnects resume from Last-Event-ID.
+    """
+    queue = license_events.subscribe(request.headers.get("last-event-id"))
+
+    async def event_stream():
+        try:
+            yield f"retry: {LICENSE_EVENTS_RETRY_MS}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=LICENSE_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is RESET:
+                    yield "event: reset\ndata: {}\n\n"
+                else:
+                    yield f"id: {event['id']}\nevent: license\ndata: {json.dumps(event)}\n\n"
+        finally:
+            license_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @router.get("/{licenses_id}")
-def get_licenses_by_id(licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
+async def get_licenses_by_id(request: Request, response: Response, licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    licenses = licenses_collection().find_one({"_id": ObjectId(licenses_id)})
+    not_modified = _not_modified(request, response)
+    if not_modified:
+        return not_modified
+
+    licenses = await licenses_collection().find_one({"_id": ObjectId(licenses_id)})
     if not licenses:
         raise HTTPException(status_code=404, detail="licenses not found")
 
-    licenses["_id"] = str(licenses["_id"])
-    if "is_avaliable" in licenses:
-        licenses["is_available"] = licenses.pop("is_avaliable")
-    if "is_available" not in licenses:
-        licenses["is_available"] = True
-    return licenses
+    return MongoJSONResponse(normalize_license(licenses), headers=response.headers)
 
-@router.post("/{licenses_id}/request")
-def request_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
+@router.get("/{licenses_id}/credentials")
+async def get_license_credentials(licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
+    """Login and mailbox credentials, for admins and whoever currently holds or has reserved the license"""
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    licenses = licenses_collection().find_one({"_id": ObjectId(licenses_id)})
+    licenses = await licenses_collection().find_one(
+        {"_id": ObjectId(licenses_id)},
+        {"username": 1, "password": 1, "gmail": 1, "mail_password": 1, "current_user": 1,
+         "reserved_by": 1, "reservation_expires_at": 1}
+    )
     if not licenses:
-        raise HTTPException(status_code=404, detail="License not found")
-    
-    is_available = licenses.get("is_available", licenses.get("is_avaliable", True))
-    
-    if not is_available:
-        current_user_id = licenses.get("current_user")
-        if current_user_id != user.get("user_id"):
-            raise HTTPException(status_code=409, detail="License is already in use by another user")
-    
-    reserved_by = licenses.get("reserved_by")
-    reservation_expires_at_str = licenses.get("reservation_expires_at")
-    
-    if reserved_by and reserved_by != user.get("user_id"):
-        if reservation_expires_at_str:
-            try:
-                reservation_expires_at = datetime.fromisoformat(reservation_expires_at_str.replace('Z', '+00:00'))
-                if reservation_expires_at.tzinfo is not None:
-                    reservation_expires_at = reservation_expires_at.replace(tzinfo=None)
-                
-                current_time = datetime.utcnow()
-                if current_time > reservation_expires_at:
-                    try:
-                        log_usage(
-                            user_id=reserved_by,
-                            user_name=licenses.get("reserved_by_name", "Unknown"),
-                            license_id=licenses_id,
-                            license_no=licenses.get("No", ""),
-                            action="reservation_expired",
-                            ip_address=None,
-                            user_agent="Auto Cleanup"
-                        )
-                    except Exception:
-                        pass
-                    
-                    clear_reservation_data = {
-                        "reserved_by": None,
-                        "reserved_by_name": None,
-                        "reserved_at": None,
-                        "reservation_expires_at": None,
-                        "last_activity": current_time.isoformat() + "Z"
-                    }
-                    
-                    licenses_collection().update_one(
-                        {"_id": ObjectId(licenses_id)},
-                        {"$set": clear_reservation_data}
-                    )
-                    
-                    licenses.update(clear_reservation_data)
-                    reserved_by = None
-                else:
-                    raise HTTPException(status_code=409, detail="License is reserved by another user")
-            except ValueError:
-                clear_reservation_data = {
-                    "reserved_by": None,
-                    "reserved_by_name": None,
-                    "reserved_at": None,
-                    "reservation_expires_at": None,
-                    "last_activity": datetime.utcnow().isoformat() + "Z"
-                }
-                
-                licenses_collection().update_one(
-                    {"_id": ObjectId(licenses_id)},
-                    {"$set": clear_reservation_data}
-                )
-                
-                licenses.update(clear_reservation_data)
-                reserved_by = None
-        else:
-            clear_reservation_data = {
-                "reserved_by": None,
-                "reserved_by_name": None,
-                "reserved_at": None,
-                "reservation_expires_at": None,
-                "last_activity": datetime.utcnow().isoformat() + "Z"
-            }
-            
-            licenses_collection().update_one(
-                {"_id": ObjectId(licenses_id)},
-                {"$set": clear_reservation_data}
-            )
-            
-            licenses.update(clear_reservation_data)
-            reserved_by = None
-    
+        raise HTTPException(status_code=404, detail="licenses not found")
+
     user_id = user.get("user_id")
-    user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-    
-    existing_reservation = licenses_collection().find_one({
-        "reserved_by": user_id,
+    holds_license = licenses.get("current_user") == user_id
+    reservation_expires_at = licenses.get("reservation_expires_at")
+    has_reservation = (
+        licenses.get("reserved_by") == user_id
+        and reservation_expires_at is not None
+        and _is_pending(reservation_expires_at, utcnow())
+    )
+    if user.get("role") != "admin" and not holds_license and not has_reservation:
+        raise HTTPException(status_code=403, detail="You don't have access to this license's credentials")
+
+    return {
+        "_id": licenses_id,
+        "username": licenses.get("username"),
+        "password": licenses.get("password"),
+        "gmail": licenses.get("gmail"),
+        "mail_password": licenses.get("mail_password")
+    }
+
+def _user_name(user: dict):
+    return f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+
+def _cleared_reservation(current_time: datetime):
+    return {
+        "reserved_by": None,
+        "reserved_by_name": None,
+        "reserved_at": None,
+        "reservation_expires_at": None,
+        "last_activity": current_time
+    }
+
+def _is_pending(deadline, current_time: datetime):
+    try:
+        return current_time <= parse_utc(deadline)
+    except ValueError:
+        return False
+
+def _request_meta(request: Request):
+    ip_address = request.client.host if request and request.client else None
+    user_agent = request.headers.get("user-agent") if request else None
+    return ip_address, user_agent
+
+@router.post("/{licenses_id}/request")
+async def request_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
+    if not ObjectId.is_valid(licenses_id):
+        raise HTTPException(status_code=400, detail="Invalid licenses ID")
+
+    user_id = user.get("user_id")
+    user_name = _user_name(user)
+    current_time = utcnow()
+    reservation_expires_at = current_time + timedelta(minutes=5)
+    reservation = {
         "is_available": True,
-        "reservation_expires_at": {"$exists": True, "$ne": None}
-    })
-    
+        "reserved_by": user_id,
+        "reserved_by_name": user_name,
+        "reserved_at": current_time,
+        "reservation_expires_at": reservation_expires_at,
+        "last_activity": current_time
+    }
+
+    # Free (or ours) and not held by a live reservation of another user
+    async with license_seq.next() as seq:
+        previous = await licenses_collection().find_one_and_update(
+            {
+                "_id": ObjectId(licenses_id),
+                "$and": [
+                    {"$or": [
+                        {"is_available": {"$ne": False}},
+                        {"current_user": user_id}
+                    ]},
+                    {"$or": [
+                        {"reserved_by": None},
+                        {"reserved_by": user_id},
+                        {"reservation_expires_at": None},
+                        {"reservation_expires_at": {"$lt": current_time}}
+                    ]}
+                ]
+            },
+            {"$set": {**reservation, "seq": seq}},
+            return_document=ReturnDocument.BEFORE
+        )
+
+        # A user holds at most one reservation; drop the one they had
+        # elsewhere. It shares this write's seq, so it needs no counter call.
+        cleared = _cleared_reservation(current_time)
+        existing_reservation = None
+        if previous is not None:
+            existing_reservation = await licenses_collection().find_one_and_update(
+                {
+                    "_id": {"$ne": ObjectId(licenses_id)},
+                    "reserved_by": user_id,
+                    "is_available": True,
+                    "reservation_expires_at": {"$ne": None}
+                },
+                {"$set": {**cleared, "seq": seq}},
+                projection={"No": 1, "reservation_expires_at": 1},
+                return_document=ReturnDocument.BEFORE
+            )
+
+    if previous is None:
+        licenses = await licenses_collection().find_one({"_id": ObjectId(licenses_id)}, {"is_available": 1})
+        if not licenses:
+            raise HTTPException(status_code=404, detail="License not found")
+        if licenses.get("is_available") is False:
+            raise HTTPException(status_code=409, detail="License is already in use by another user")
+        raise HTTPException(status_code=409, detail="License is reserved by another user")
+    license_events.publish("update", licenses_id, {**reservation, "seq": seq})
+
+    previous_holder = previous.get("reserved_by")
+    if previous_holder and previous_holder != user_id and previous.get("reservation_expires_at"):
+        await log_usage(
+            user_id=previous_holder,
+            user_name=previous.get("reserved_by_name", "Unknown"),
+            license_id=licenses_id,
+            license_no=previous.get("No", ""),
+            action="reservation_expired",
+            ip_address=None,
+            user_agent="Auto Cleanup"
+        )
+
     if existing_reservation:
-        existing_license_id = str(existing_reservation["_id"])
-        
-        if existing_license_id != licenses_id:
-            existing_expires_at_str = existing_reservation.get("reservation_expires_at")
-            if existing_expires_at_str:
-                try:
-                    existing_expires_at = datetime.fromisoformat(existing_expires_at_str.replace('Z', '+00:00'))
-                    if existing_expires_at.tzinfo is not None:
-                        existing_expires_at = existing_expires_at.replace(tzinfo=None)
-                    
-                    current_time = datetime.utcnow()
-                    if current_time <= existing_expires_at:
-                        try:
-                            log_usage(
-                                user_id=user_id,
-                                user_name=user_name,
-                                license_id=existing_license_id,
-                                license_no=existing_reservation.get("No", ""),
-                                action="reservation_auto_canceled",
-                                ip_address=None,
-                                user_agent="Auto Switch"
-                            )
-                        except Exception:
-                            pass
-                        
-                        licenses_collection().update_one(
-                            {"_id": existing_reservation["_id"]},
-                            {"$set": {
-                                "reserved_by": None,
-                                "reserved_by_name": None,
-                                "reserved_at": None,
-                                "reservation_expires_at": None,
-                                "last_activity": current_time.isoformat() + "Z"
-                            }}
-                        )
-                    else:
-                        licenses_collection().update_one(
-                            {"_id": existing_reservation["_id"]},
-                            {"$set": {
-                                "reserved_by": None,
-                                "reserved_by_name": None,
-                                "reserved_at": None,
-                                "reservation_expires_at": None,
-                                "last_activity": current_time.isoformat() + "Z"
-                            }}
-                        )
-                except ValueError:
-                    licenses_collection().update_one(
-                        {"_id": existing_reservation["_id"]},
-                        {"$set": {
-                            "reserved_by": None,
-                            "reserved_by_name": None,
-                            "reserved_at": None,
-                            "reservation_expires_at": None,
-                            "last_activity": datetime.utcnow().isoformat() + "Z"
-                        }}
-                    )
-    
-    try:
-        ip_address = request.client.host if request else None
-        user_agent = request.headers.get("user-agent") if request else None
-        log_usage(
+        license_events.publish("update", existing_reservation["_id"], {**cleared, "seq": seq})
+
+    if existing_reservation and _is_pending(existing_reservation["reservation_expires_at"], current_time):
+        await log_usage(
             user_id=user_id,
             user_name=user_name,
-            license_id=licenses_id,
-            license_no=licenses.get("No", ""),
-            action="request_license",
-            ip_address=ip_address,
-            user_agent=user_agent
+            license_id=str(existing_reservation["_id"]),
+            license_no=existing_reservation.get("No", ""),
+            action="reservation_auto_canceled",
+            ip_address=None,
+            user_agent="Auto Switch"
         )
-    except Exception:
-        pass
-    
-    reservation_expires_at = datetime.utcnow() + timedelta(minutes=5)
-    
-    update_data = {
-        "is_available": True,
-        "reserved_by": user.get("user_id"),
-        "reserved_by_name": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
-        "reserved_at": datetime.utcnow().isoformat() + "Z",
-        "reservation_expires_at": reservation_expires_at.isoformat() + "Z",
-        "last_activity": datetime.utcnow().isoformat()
-    }
-    
-    result = licenses_collection().update_one(
-        {"_id": ObjectId(licenses_id)},
-        {"$set": update_data}
+
+    ip_address, user_agent = _request_meta(request)
+    await log_usage(
+        user_id=user_id,
+        user_name=user_name,
+        license_id=licenses_id,
+        license_no=previous.get("No", ""),
+        action="request_license",
+        ip_address=ip_address,
+        user_agent=user_agent
     )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="License not found")
-    
+
+    expiry_scheduler.schedule(reservation_expires_at)
+
     return {"message": "License reserved successfully. Request OTP to activate."}
 
 @router.post("/{licenses_id}/cancel-reservation")
-def cancel_license_reservation(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
+async def cancel_license_reservation(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    licenses = licenses_collection().find_one({"_id": ObjectId(licenses_id)})
-    if not licenses:
-        raise HTTPException(status_code=404, detail="License not found")
-    
     user_id = user.get("user_id")
-    user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+    user_name = _user_name(user)
     is_admin = user.get("role") == "admin"
-    reserved_by = licenses.get("reserved_by")
-    
-    if reserved_by != user_id and not is_admin:
-        raise HTTPException(status_code=403, detail="You don't have permission to cancel this reservation")
-    
-    if not licenses.get("is_available", True):
-        raise HTTPException(status_code=409, detail="License is already activated. Use release instead.")
-    
-    if not reserved_by:
-        raise HTTPException(status_code=404, detail="No reservation found for this license")
-    
-    try:
-        ip_address = request.client.host if request else None
-        user_agent = request.headers.get("user-agent") if request else None
-        action = "cancel_reservation_admin" if is_admin and reserved_by != user_id else "cancel_reservation"
-        log_usage(
-            user_id=user_id,
-            user_name=user_name,
-            license_id=licenses_id,
-            license_no=licenses.get("No", ""),
-            action=action,
-            ip_address=ip_address,
-            user_agent=user_agent
+    cleared = _cleared_reservation(utcnow())
+
+    async with license_seq.next() as seq:
+        previous = await licenses_collection().find_one_and_update(
+            {
+                "_id": ObjectId(licenses_id),
+                "is_available": {"$ne": False},
+                "reserved_by": {"$ne": None} if is_admin else user_id
+            },
+            {"$set": {**cleared, "seq": seq}},
+            projection={"No": 1, "reserved_by": 1},
+            return_document=ReturnDocument.BEFORE
         )
-    except Exception:
-        pass
-    
-    update_data = {
-        "reserved_by": None,
-        "reserved_by_name": None,
-        "reserved_at": None,
-        "reservation_expires_at": None,
-        "last_activity": datetime.utcnow().isoformat() + "Z"
-    }
-    
-    result = licenses_collection().update_one(
-        {"_id": ObjectId(licenses_id)},
-        {"$set": update_data}
+
+    if previous is None:
+        licenses = await licenses_collection().find_one(
+            {"_id": ObjectId(licenses_id)}, {"is_available": 1, "reserved_by": 1}
+        )
+        if not licenses:
+            raise HTTPException(status_code=404, detail="License not found")
+        reserved_by = licenses.get("reserved_by")
+        if reserved_by != user_id and not is_admin:
+            raise HTTPException(status_code=403, detail="You don't have permission to cancel this reservation")
+        if not licenses.get("is_available", True):
+            raise HTTPException(status_code=409, detail="License is already activated. Use release instead.")
+        raise HTTPException(status_code=404, detail="No reservation found for this license")
+    license_events.publish("update", licenses_id, {**cleared, "seq": seq})
+
+    ip_address, user_agent = _request_meta(request)
+    action = "cancel_reservation_admin" if is_admin and previous.get("reserved_by") != user_id else "cancel_reservation"
+    await log_usage(
+        user_id=user_id,
+        user_name=user_name,
+        license_id=licenses_id,
+        license_no=previous.get("No", ""),
+        action=action,
+        ip_address=ip_address,
+        user_agent=user_agent
     )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="License not found")
-    
+
     return {"message": "Reservation cancelled successfully"}
 
 @router.post("/{licenses_id}/activate")
-def activate_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
+async def activate_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    licenses = licenses_collection().find_one({"_id": ObjectId(licenses_id)})
-    if not licenses:
-        raise HTTPException(status_code=404, detail="License not found")
-    
     user_id = user.get("user_id")
-    user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
-    reserved_by = licenses.get("reserved_by")
-    
-    if reserved_by != user_id:
-        raise HTTPException(status_code=403, detail="You haven't reserved this license")
-    
-    if not licenses.get("is_available", True):
-        current_user_id = licenses.get("current_user")
-        if current_user_id == user_id:
-            expires_at = licenses.get("expires_at")
-            if expires_at:
-                try:
-                    expires_time_str = expires_at.replace('Z', '+00:00') if expires_at.endswith('Z') else expires_at
-                    expires_time = datetime.fromisoformat(expires_time_str)
-                    
-                    if expires_time.tzinfo is not None:
-                        expires_time = expires_time.replace(tzinfo=None)
-                    
-                    if datetime.utcnow() < expires_time:
-                        return_expires_at = expires_at if expires_at.endswith('Z') else expires_at + 'Z'
-                        return {"message": "License is already active", "expires_at": return_expires_at}
-                except ValueError:
-                    pass
-        else:
-            raise HTTPException(status_code=409, detail="License is already in use by another user")
-    
-    expires_at = datetime.utcnow() + timedelta(hours=2)
-    
-    try:
-        ip_address = request.client.host if request else None
-        user_agent = request.headers.get("user-agent") if request else None
-        log_usage(
-            user_id=user_id,
-            user_name=user_name,
-            license_id=licenses_id,
-            license_no=licenses.get("No", ""),
-            action="activate_license",
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
-    except Exception:
-        pass
-    
-    update_data = {
+    user_name = _user_name(user)
+    current_time = utcnow()
+    expires_at = current_time + timedelta(hours=2)
+    lease = {
         "is_available": False,
         "current_user": user_id,
-        "current_user_name": f"{user.get('first_name', '')} {user.get('last_name', '')}".strip(),
-        "assigned_at": datetime.utcnow().isoformat() + "Z",
-        "expires_at": expires_at.isoformat() + "Z",
-        "last_activity": datetime.utcnow().isoformat() + "Z",
-        "reserved_by": reserved_by,
-        "reserved_by_name": licenses.get("reserved_by_name"),
-        "reserved_at": licenses.get("reserved_at")
+        "current_user_name": user_name,
+        "assigned_at": current_time,
+        "expires_at": expires_at,
+        "last_activity": current_time
     }
-    
-    result = licenses_collection().update_one(
-        {"_id": ObjectId(licenses_id)},
-        {"$set": update_data}
+
+    # Reserved by the caller and either free or holding a lapsed lease of theirs
+    async with license_seq.next() as seq:
+        licenses = await licenses_collection().find_one_and_update(
+            {
+                "_id": ObjectId(licenses_id),
+                "reserved_by": user_id,
+                "$or": [
+                    {"is_available": {"$ne": False}},
+                    {"current_user": user_id, "expires_at": None},
+                    {"current_user": user_id, "expires_at": {"$lte": current_time}}
+                ]
+            },
+            {"$set": {**lease, "seq": seq}},
+            projection={"No": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    if licenses is None:
+        licenses = await licenses_collection().find_one(
+            {"_id": ObjectId(licenses_id)}, {"reserved_by": 1, "current_user": 1, "expires_at": 1}
+        )
+        if not licenses:
+            raise HTTPException(status_code=404, detail="License not found")
+        if licenses.get("reserved_by") != user_id:
+            raise HTTPException(status_code=403, detail="You haven't reserved this license")
+        if licenses.get("current_user") == user_id:
+            current_expires_at = licenses["expires_at"]
+            return {"message": "License is already active", "expires_at": to_iso(current_expires_at)}
+        raise HTTPException(status_code=409, detail="License is already in use by another user")
+    license_events.publish("update", licenses_id, {**lease, "seq": seq})
+
+    ip_address, user_agent = _request_meta(request)
+    await log_usage(
+        user_id=user_id,
+        user_name=user_name,
+        license_id=licenses_id,
+        license_no=licenses.get("No", ""),
+        action="activate_license",
+        ip_address=ip_address,
+        user_agent=user_agent
     )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="License not found")
-    
-    return {"message": "License activated successfully", "expires_at": expires_at.isoformat() + "Z"}
+
+    expiry_scheduler.schedule(expires_at)
+
+    return {"message": "License activated successfully", "expires_at": to_iso(expires_at)}
 
 @router.post("/{licenses_id}/release")
-def release_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
+async def release_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user), request: Request = None):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    licenses = licenses_collection().find_one({"_id": ObjectId(licenses_id)})
-    if not licenses:
-        raise HTTPException(status_code=404, detail="License not found")
-    
     user_id = user.get("user_id")
-    user_name = f"{user.get('first_name', '')} {user.get('last_name', '')}".strip()
+    user_name = _user_name(user)
     is_admin = user.get("role") == "admin"
-    is_current_user = licenses.get("current_user") == user_id
-    
-    if not is_admin and not is_current_user:
-        raise HTTPException(status_code=403, detail="You don't have permission to release this license")
-    
-    duration_seconds = None
-    if licenses.get("assigned_at"):
-        try:
-            assigned_at_str = licenses.get("assigned_at", "").replace('Z', '+00:00')
-            assigned_at = datetime.fromisoformat(assigned_at_str)
-            if assigned_at.tzinfo is not None:
-                assigned_at = assigned_at.replace(tzinfo=None)
-            duration_seconds = int((datetime.utcnow() - assigned_at).total_seconds())
-        except Exception:
-            pass
-    
-    try:
-        ip_address = request.client.host if request else None
-        user_agent = request.headers.get("user-agent") if request else None
-        log_usage(
-            user_id=user_id,
-            user_name=user_name,
-            license_id=licenses_id,
-            license_no=licenses.get("No", ""),
-            action="release_license",
-            duration_seconds=duration_seconds,
-            ip_address=ip_address,
-            user_agent=user_agent
-        )
-    except Exception:
-        pass
-    
-    update_data = {
+    current_time = utcnow()
+
+    query = {"_id": ObjectId(licenses_id)}
+    if not is_admin:
+        query["current_user"] = user_id
+
+    released = {
         "is_available": True,
         "current_user": None,
         "current_user_name": None,
         "assigned_at": None,
         "expires_at": None,
-        "reserved_by": None,
-        "reserved_by_name": None,
-        "reserved_at": None,
-        "reservation_expires_at": None,
-        "last_activity": datetime.utcnow().isoformat() + "Z"
+        **_cleared_reservation(current_time)
     }
-    
-    result = licenses_collection().update_one(
-        {"_id": ObjectId(licenses_id)},
-        {"$set": update_data}
+
+    async with license_seq.next() as seq:
+        previous = await licenses_collection().find_one_and_update(
+            query,
+            {"$set": {**released, "seq": seq}},
+            projection={"No": 1, "assigned_at": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+
+    if previous is None:
+        if not await licenses_collection().find_one({"_id": ObjectId(licenses_id)}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="License not found")
+        raise HTTPException(status_code=403, detail="You don't have permission to release this license")
+    license_events.publish("update", licenses_id, {**released, "seq": seq})
+
+    duration_seconds = None
+    if previous.get("assigned_at"):
+        try:
+            duration_seconds = int((current_time - parse_utc(previous["assigned_at"])).total_seconds())
+        except Exception:
+            pass
+
+    ip_address, user_agent = _request_meta(request)
+    await log_usage(
+        user_id=user_id,
+        user_name=user_name,
+        license_id=licenses_id,
+        license_no=previous.get("No", ""),
+        action="release_license",
+        duration_seconds=duration_seconds,
+        ip_address=ip_address,
+        user_agent=user_agent
     )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="License not found")
-    
+
     return {"message": "License released successfully"}
 
 @router.post("/cleanup-expired")
-def cleanup_expired_licenses():
-    current_time = datetime.utcnow()
-    
-    potential_expired_licenses = licenses_collection().find({
-        "is_available": False,
-        "expires_at": {"$exists": True, "$ne": None}
-    })
-    
-    expired_licenses_count = 0
-    for license in potential_expired_licenses:
-        expires_at_str = license.get("expires_at")
-        if expires_at_str:
-            try:
-                expires_at = datetime.fromisoformat(expires_at_str.replace('Z', '+00:00'))
-                if expires_at.tzinfo is not None:
-                    expires_at = expires_at.replace(tzinfo=None)
-                
-                if current_time > expires_at:
-                    try:
-                        current_user_name = license.get("current_user_name", "")
-                        assigned_at_str = license.get("assigned_at", "")
-                        duration_seconds = None
-                        
-                        if assigned_at_str:
-                            try:
-                                assigned_at = datetime.fromisoformat(assigned_at_str.replace('Z', '+00:00'))
-                                if assigned_at.tzinfo is not None:
-                                    assigned_at = assigned_at.replace(tzinfo=None)
-                                duration_seconds = int((current_time - assigned_at).total_seconds())
-                            except Exception:
-                                pass
-                        
-                        log_usage(
-                            user_id=license.get("current_user", "system"),
-                            user_name=current_user_name or "System Cleanup",
-                            license_id=str(license["_id"]),
-                            license_no=license.get("No", ""),
-                            action="license_expired",
-                            duration_seconds=duration_seconds,
-                            ip_address=None,
-                            user_agent="System Cleanup"
-                        )
-                    except Exception:
-                        pass
-                    
-                    update_data = {
-                        "is_available": True,
-                        "current_user": None,
-                        "current_user_name": None,
-                        "assigned_at": None,
-                        "expires_at": None,
-                        "reserved_by": None,
-                        "reserved_by_name": None,
-                        "reserved_at": None,
-                        "reservation_expires_at": None,
-                        "last_activity": current_time.isoformat() + "Z"
-                    }
-                    
-                    licenses_collection().update_one(
-                        {"_id": license["_id"]},
-                        {"$set": update_data}
-                    )
-                    expired_licenses_count += 1
-            except Exception:
-                continue
-    
-    potential_expired_reservations = licenses_collection().find({
-        "is_available": True,
-        "reserved_by": {"$exists": True, "$ne": None},
-        "reservation_expires_at": {"$exists": True, "$ne": None}
-    })
-    
-    expired_reservations_count = 0
-    for license in potential_expired_reservations:
-        reservation_expires_at_str = license.get("reservation_expires_at")
-        if reservation_expires_at_str:
-            try:
-                reservation_expires_at = datetime.fromisoformat(reservation_expires_at_str.replace('Z', '+00:00'))
-                if reservation_expires_at.tzinfo is not None:
-                    reservation_expires_at = reservation_expires_at.replace(tzinfo=None)
-                
-                if current_time > reservation_expires_at:
-                    try:
-                        log_usage(
-                            user_id=license.get("reserved_by", "system"),
-                            user_name=license.get("reserved_by_name", "System Cleanup"),
-                            license_id=str(license["_id"]),
-                            license_no=license.get("No", ""),
-                            action="reservation_expired",
-                            ip_address=None,
-                            user_agent="System Cleanup"
-                        )
-                    except Exception:
-                        pass
-                    
-                    update_data = {
-                        "reserved_by": None,
-                        "reserved_by_name": None,
-                        "reserved_at": None,
-                        "reservation_expires_at": None,
-                        "last_activity": current_time.isoformat() + "Z"
-                    }
-                    
-                    licenses_collection().update_one(
-                        {"_id": license["_id"]},
-                        {"$set": update_data}
-                    )
-                    expired_reservations_count += 1
-            except Exception:
-                continue
+async def cleanup_expired_licenses():
+    expired_licenses_count, expired_reservations_count = await sweep_expired()
     
     return {
         "message": f"Cleaned up {expired_licenses_count} expired licenses and {expired_reservations_count} expired reservations"
     }
 
 @router.post("/fix-data-inconsistencies")
-def fix_data_inconsistencies():
+async def fix_data_inconsistencies():
     licenses_with_old_field = licenses_collection().find({"is_avaliable": {"$exists": True}})
     
     converted_count = 0
-    for license in licenses_with_old_field:
+    async for license in licenses_with_old_field:
         update_data = {
             "is_available": license.get("is_avaliable", True)
         }
         
-        licenses_collection().update_one(
-            {"_id": license["_id"]},
-            {
-                "$set": update_data,
-                "$unset": {"is_avaliable": ""}
-            }
-        )
+        async with license_seq.next() as seq:
+            await licenses_collection().update_one(
+                {"_id": license["_id"]},
+                {
+                    "$set": {**update_data, "seq": seq},
+                    "$unset": {"is_avaliable": ""}
+                }
+            )
+        license_events.publish("update", license["_id"], {**update_data, "seq": seq})
         converted_count += 1
     
     inconsistent_licenses = licenses_collection().find({
@@ -653,20 +653,22 @@ def fix_data_inconsistencies():
     })
     
     fixed_count = 0
-    for license in inconsistent_licenses:
+    async for license in inconsistent_licenses:
         update_data = {
             "is_available": True,
             "current_user": None,
             "current_user_name": None,
             "assigned_at": None,
             "expires_at": None,
-            "last_activity": datetime.utcnow().isoformat()
+            "last_activity": utcnow()
         }
         
-        licenses_collection().update_one(
-            {"_id": license["_id"]},
-            {"$set": update_data}
-        )
+        async with license_seq.next() as seq:
+            await licenses_collection().update_one(
+                {"_id": license["_id"]},
+                {"$set": {**update_data, "seq": seq}}
+            )
+        license_events.publish("update", license["_id"], {**update_data, "seq": seq})
         fixed_count += 1
     
     return {
@@ -674,40 +676,45 @@ def fix_data_inconsistencies():
     }
 
 @router.post("/{licenses_id}/extend")
-def extend_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
+async def extend_license(licenses_id: str = Path(...), user: dict = Depends(get_current_user)):
     if not ObjectId.is_valid(licenses_id):
         raise HTTPException(status_code=400, detail="Invalid licenses ID")
 
-    licenses = licenses_collection().find_one({"_id": ObjectId(licenses_id)})
-    if not licenses:
-        raise HTTPException(status_code=404, detail="License not found")
-    
-    if licenses.get("current_user") != user.get("user_id"):
-        raise HTTPException(status_code=403, detail="You don't own this license")
-    
-    if licenses.get("is_available", True):
-        raise HTTPException(status_code=400, detail="License is not currently in use")
-    
-    expires_at = licenses.get("expires_at")
-    if expires_at:
-        expires_time = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-        time_left = expires_time - datetime.utcnow()
-        if time_left.total_seconds() > 900:
-            raise HTTPException(status_code=400, detail="You can only extend the license when there are 15 minutes or less remaining")
-    
-    new_expires_at = datetime.utcnow() + timedelta(hours=2)
-    
-    update_data = {
-        "expires_at": new_expires_at.isoformat(),
-        "last_activity": datetime.utcnow().isoformat()
-    }
-    
-    result = licenses_collection().update_one(
-        {"_id": ObjectId(licenses_id)},
-        {"$set": update_data}
-    )
-    
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="License not found")
-    
-    return {"message": "License extended successfully", "new_expires_at": new_expires_at.isoformat()}
\ No newline at end of file
+    current_time = utcnow()
+    new_expires_at = current_time + timedelta(hours=2)
+    extend_window_start = current_time + timedelta(seconds=900)
+    extension = {"expires_at": new_expires_at, "last_activity": current_time}
+
+    # Only the holder may extend, and only inside the last 15 minutes
+    async with license_seq.next() as seq:
+        licenses = await licenses_collection().find_one_and_update(
+            {
+                "_id": ObjectId(licenses_id),
+                "current_user": user.get("user_id"),
+                "is_available": False,
+                "$or": [
+                    {"expires_at": None},
+                    {"expires_at": {"$lte": extend_window_start}}
+                ]
+            },
+            {"$set": {**extension, "seq": seq}},
+            projection={"_id": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+    if licenses is None:
+        licenses = await licenses_collection().find_one(
+            {"_id": ObjectId(licenses_id)}, {"current_user": 1, "is_available": 1}
+        )
+        if not licenses:
+            raise HTTPException(status_code=404, detail="License not found")
+        if licenses.get("current_user") != user.get("user_id"):
+            raise HTTPException(status_code=403, detail="You don't own this license")
+        if licenses.get("is_available", True):
+            raise HTTPException(status_code=400, detail="License is not currently in use")
+        raise HTTPException(status_code=400, detail="You can only extend the license when there are 15 minutes or less remaining")
+    license_events.publish("update", licenses_id, {**extension, "seq": seq})
+
+    expiry_scheduler.schedule(new_expires_at)
+
+    return {"message": "License extended successfully", "new_expires_at": to_iso(new_expires_at)}
@@ -1,81 +1,183 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from dotenv import load_dotenv
+import asyncio
+import logging
 import os
-import imaplib
-import email
-import re
-from email.utils import parsedate_to_datetime
-from zoneinfo import ZoneInfo
+from app.dependencies.auth import require_admin
+from app.services.imap_pool import imap_pool
+from app.services.mail_accounts import mail_accounts
+from app.services.otp_reader import reset_cursors, scan_for_otp
+from app.services.otp_store import otp_store
+from app.services.otp_watcher import OTP_WATCH_SUBJECT, otp_watchers
+from app.utils.cache import TTLCache
+from app.utils.singleflight import SingleFlight
+from app.utils.time_utils import parse_utc
 
 load_dotenv()
 
-LICENSE_ACCOUNTS = {
-    f"license{i}": {
-        "email": os.getenv(f"LICENSE{i}_EMAIL"),
-        "password": os.getenv(f"LICENSE{i}_PASSWORD")
-    } for i in range(1, 13)
-}
+OTP_WAIT_MAX_SECONDS = float(os.getenv("OTP_WAIT_MAX_SECONDS", "30"))
+OTP_WAIT_POLL_SECONDS = float(os.getenv("OTP_WAIT_POLL_SECONDS", "3"))
+OTP_CACHE_SECONDS = float(os.getenv("OTP_CACHE_SECONDS", "5"))
 
-IMAP_SERVER = os.getenv("IMAP_SERVER")
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/otp", tags=["OTP"])
 
+# One mailbox poller per license, shared by every /wait request for it
+_pollers = {}
+
+# Mailbox lookups keyed by (license_id, subject_keyword): results are kept
+# for OTP_CACHE_SECONDS and concurrent misses share one IMAP scan
+otp_cache = TTLCache(maxsize=256, ttl=OTP_CACHE_SECONDS)
+otp_flights = SingleFlight()
+
+def on_accounts_changed(license_ids: set):
+    """Forget per-mailbox state for licenses whose credentials changed and re-point the watchers"""
+    for license_id in license_ids:
+        otp_store.discard(license_id)
+        reset_cursors(license_id)
+    otp_cache.clear()
+    otp_watchers.sync(mail_accounts.accounts())
+
+mail_accounts.add_listener(on_accounts_changed)
+
+def fetch_otp(license: dict, license_id: str, subject_keyword: str):
+    try:
+        otp = imap_pool.run(
+            license_id, license["email"], license["password"],
+            lambda session: scan_for_otp(session, license_id, subject_keyword)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch OTP: {str(e)}")
+
+    if otp and subject_keyword == OTP_WATCH_SUBJECT:
+        otp_store.publish(license_id, otp)
+    return otp or {"message": "No OTP emails found"}
+
+async def lookup_otp(license_id: str, subject_keyword: str):
+    key = (license_id, subject_keyword)
+    cached = otp_cache.get(key)
+    if cached is not None:
+        return cached
+
+    account = mail_accounts.get(license_id)
+    if account is None:
+        raise HTTPException(status_code=400, detail="Invalid license ID")
+
+    async def fetch():
+        try:
+            result = await imap_pool.call(fetch_otp, account, license_id, subject_keyword)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Timed out fetching OTP")
+        otp_cache.set(key, result)
+        return result
+
+    return await otp_flights.do(key, fetch)
+
+def validate_license_id(license_id: str):
+    license_id = license_id.strip()
+    if mail_accounts.get(license_id) is None:
+        raise HTTPException(status_code=400, detail="Invalid license ID")
+    return license_id
+
+async def get_latest_otp(license_id: str, subject_keyword: str):
+    # A connected watcher already pushes every new OTP into the store
+    if otp_watchers.is_watching(license_id, subject_keyword):
+        entry = otp_store.get(license_id)
+        return entry["otp"] if entry else {"message": "No OTP emails found"}
+
+    return await lookup_otp(license_id, subject_keyword)
+
 @router.get("/get")
-def get_otp(
-    subject_keyword: str = Query("Your one-time security code"),
+async def get_otp(
+    subject_keyword: str = Query(OTP_WATCH_SUBJECT),
     license_id: str = Query(...),
 ):
-    license_id = license_id.strip()
-    if license_id not in LICENSE_ACCOUNTS or not LICENSE_ACCOUNTS[license_id]["email"]:
-        raise HTTPException(status_code=400, detail="Invalid license ID")
-    
-    license = LICENSE_ACCOUNTS[license_id]
+    license_id = validate_license_id(license_id)
+    return await get_latest_otp(license_id, subject_keyword)
+
+@router.get("/get-many", dependencies=[Depends(require_admin)])
+async def get_many_otps(
+    subject_keyword: str = Query(OTP_WATCH_SUBJECT),
+    license_id: list[str] | None = Query(None, description="Repeat for each license; omit for every configured account"),
+):
+    """
+    Latest OTP for several licenses, looked up in parallel. Each license's
+    result is either its OTP payload or {"error": ...}, so one unreachable
+    mailbox does not fail the whole batch.
+    """
+    if license_id:
+        license_ids = list(dict.fromkeys(validate_license_id(value) for value in license_id))
+    else:
+        license_ids = sorted(mail_accounts.accounts(), key=lambda key: int(key[len("license"):]))
+
+    results = await asyncio.gather(
+        *(get_latest_otp(key, subject_keyword) for key in license_ids),
+        return_exceptions=True
+    )
+
+    response = {}
+    for key, result in zip(license_ids, results):
+        if isinstance(result, HTTPException):
+            response[key] = {"error": result.detail}
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            response[key] = result
+    return response
+
+async def poll_mailbox(license_id: str):
+    """Check the mailbox every OTP_WAIT_POLL_SECONDS while anyone is waiting and no watcher is connected"""
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-        mail.login(license["email"], license["password"])
-        mail.select("inbox")
-
-        result, data = mail.search(None, f'(TEXT "{subject_keyword}")')
-        if result != "OK":
-            raise HTTPException(status_code=500, detail="Error searching inbox")
-
-        email_ids = data[0].split()
-        if not email_ids:
-            return {"message": "No OTP emails found"}
-
-        for email_id in reversed(email_ids):
-            result, data = mail.fetch(email_id, "(RFC822)")
-            raw_email = data[0][1]
-            message = email.message_from_bytes(raw_email)
-
-            msg_body = ""
-            if message.is_multipart():
-                for part in message.walk():
-                    content_type = part.get_content_type()
-                    if content_type in ("text/html", "text/plain"):
-                        msg_body = part.get_payload(decode=True).decode()
-                        break
-            else:
-                msg_body = message.get_payload(decode=True).decode()
-
-            otp_match = re.search(r"\b\d{6}\b", msg_body)
-            if not otp_match:
-                continue
-
-            email_datetime = parsedate_to_datetime(message["Date"])
-            thai_time = email_datetime.astimezone(ZoneInfo("Asia/Bangkok"))
-            formatted_date = thai_time.strftime("%Y-%m-%d %H:%M:%S")
-
-            return {
-                "otp": otp_match.group(0),
-                "from": message["From"],
-                "to": message.get("To", ""),
-                "subject": message["Subject"],
-                "date": formatted_date,
-                "license_id": license_id
-            }
-
-        return {"message": "No matching OTP email found from specified sender"}
+        while otp_store.has_waiters(license_id) and not otp_watchers.is_watching(license_id, OTP_WATCH_SUBJECT):
+            try:
+                await lookup_otp(license_id, OTP_WATCH_SUBJECT)
+            except HTTPException as e:
+                logger.warning("OTP poll for %s failed: %s", license_id, e.detail)
+            await asyncio.sleep(OTP_WAIT_POLL_SECONDS)
+    finally:
+        _pollers.pop(license_id, None)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch OTP: {str(e)}")
\ No newline at end of file
+def ensure_poller(license_id: str):
+    if license_id not in _pollers:
+        _pollers[license_id] = asyncio.create_task(poll_mailbox(license_id))
+
+@router.get("/wait")
+async def wait_for_otp(
+    license_id: str = Query(...),
+    after: str | None = Query(None, description="ISO timestamp; only an OTP sent after it is returned"),
+    timeout: float = Query(25, gt=0, le=OTP_WAIT_MAX_SECONDS),
+):
+    """
+    Long-poll for a fresh OTP. Held until the license's OTP mail is newer
+    than `after` or the timeout passes. Served from the watcher's store when
+    one is connected, otherwise every waiter shares a single polling task.
+    """
+    license_id = validate_license_id(license_id)
+
+    try:
+        after_time = parse_utc(after) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid after format")
+
+    # The poller task first runs once this request has registered as a
+    # waiter, so its has_waiters() check always sees it
+    if not otp_watchers.is_watching(license_id, OTP_WATCH_SUBJECT):
+        ensure_poller(license_id)
+    entry = await otp_store.wait_for_newer(license_id, after_time, timeout)
+
+    if entry is None:
+        return {"message": "No new OTP yet"}
+    return entry["otp"]
+
+@router.get("/pool-stats", dependencies=[Depends(require_admin)])
+async def get_imap_pool_stats():
+    return imap_pool.stats()
+
+@router.get("/cache-stats", dependencies=[Depends(require_admin)])
+async def get_otp_cache_stats():
+    return {"cache": otp_cache.stats(), "single_flight": otp_flights.stats()}
+
+@router.get("/watcher-stats", dependencies=[Depends(require_admin)])
+async def get_otp_watcher_stats():
+    return otp_watchers.stats()
@@ -1,55 +1,86 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from app.dependencies.auth import require_admin
 from app.models.usage_log_model import get_usage_log_collection
+from app.services.log_sink import usage_log_sink
+from app.services.usage_rollups import apply_rollups, bucket_start, get_rollup_collection
+from app.utils.cache import TTLCache
+from app.utils.json_response import MongoJSONResponse
+from app.utils.time_utils import parse_utc, to_iso, utcnow
+from bson import ObjectId
+from bson.errors import InvalidId
 from datetime import datetime, timedelta
 from fastapi.responses import StreamingResponse
+import base64
 import csv
 import io
-from typing import Optional
+import json
+import logging
+import os
+import zlib
+from typing import Literal, Optional
 
 router = APIRouter(prefix="/usage-logs", tags=["Usage Logs"])
+logger = logging.getLogger(__name__)
 
-def log_usage(user_id: str, user_name: str, license_id: str, license_no: str, action: str, 
-              duration_seconds: Optional[int] = None, ip_address: Optional[str] = None, 
-              user_agent: Optional[str] = None):
+EXPORT_BATCH_SIZE = int(os.getenv("USAGE_LOG_EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("USAGE_LOG_EXPORT_CHUNK_ROWS", "500"))
+log_count_cache = TTLCache(maxsize=256, ttl=float(os.getenv("USAGE_LOG_COUNT_CACHE_SECONDS", "30")))
+CSV_FIELDS = [
+    'timestamp', 'user_id', 'user_name', 'license_id', 'license_no', 
+    'action', 'duration_seconds', 'ip_address', 'user_agent'
+]
+
+def build_usage_log(user_id: str, user_name: str, license_id: str, license_no: str, action: str, 
+                    duration_seconds: Optional[int] = None, ip_address: Optional[str] = None, 
+                    user_agent: Optional[str] = None, timestamp: Optional[datetime] = None):
+    return {
+        "user_id": user_id,
+        "user_name": user_name,
+        "license_id": license_id,
+        "license_no": license_no,
+        "action": action,
+        "timestamp": timestamp or utcnow(),
+        "duration_seconds": duration_seconds,
+        "ip_address": ip_address,
+        "user_agent": user_agent
+    }
+
+async def log_usage(user_id: str, user_name: str, license_id: str, license_no: str, action: str, 
+                    duration_seconds: Optional[int] = None, ip_address: Optional[str] = None, 
+                    user_agent: Optional[str] = None):
+    log_data = build_usage_log(user_id, user_name, license_id, license_no, action,
+                               duration_seconds, ip_address, user_agent)
+    await log_usage_many([log_data])
+
+async def log_usage_many(log_entries: list):
+    """Queue entries on the background sink; write directly when it isn't running (e.g. CLI tools)"""
+    if not log_entries:
+        return
+    if usage_log_sink.running:
+        await usage_log_sink.put_many(log_entries)
+        return
     try:
-        log_collection = get_usage_log_collection()
-        log_data = {
-            "user_id": user_id,
-            "user_name": user_name,
-            "license_id": license_id,
-            "license_no": license_no,
-            "action": action,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "duration_seconds": duration_seconds,
-            "ip_address": ip_address,
-            "user_agent": user_agent
-        }
-        log_collection.insert_one(log_data)
-    except Exception as e:
-        print(f"Error logging usage: {e}")
+        await get_usage_log_collection().insert_many(log_entries, ordered=False)
+    except Exception:
+        logger.exception("Error logging usage")
+        return
+    await apply_rollups(log_entries)
 
-@router.get("/", dependencies=[Depends(require_admin)])
-def get_usage_logs(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    user_id: Optional[str] = None,
-    license_id: Optional[str] = None,
-    action: Optional[str] = None,
-    limit: int = 100,
-    skip: int = 0
-):
-    log_collection = get_usage_log_collection()
-    
+def build_log_query(start_date: Optional[str], end_date: Optional[str], user_id: Optional[str],
+                    license_id: Optional[str], action: Optional[str]):
     query = {}
     
     if start_date:
-        query["timestamp"] = {"$gte": start_date}
+        try:
+            query["timestamp"] = {"$gte": parse_utc(start_date)}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid start_date format")
+    
     if end_date:
-        if "timestamp" in query:
-            query["timestamp"]["$lte"] = end_date
-        else:
-            query["timestamp"] = {"$lte": end_date}
+        try:
+            query.setdefault("timestamp", {})["$lte"] = parse_utc(end_date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid end_date format")
     
     if user_id:
         query["user_id"] = user_id
@@ -58,116 +89,227 @@ def get_usage_logs(
     if action:
         query["action"] = action
     
-    logs = list(log_collection.find(query).sort("timestamp", -1).skip(skip).limit(limit))
-    
-    for log in logs:
-        log["_id"] = str(log["_id"])
-    
-    total_count = log_collection.count_documents(query)
-    
-    return {
-        "logs": logs,
-        "total_count": total_count,
-        "limit": limit,
-        "skip": skip
-    }
+    return query
 
-@router.get("/download", dependencies=[Depends(require_admin)])
-def download_usage_logs(
+def encode_cursor(log: dict):
+    payload = json.dumps({"t": to_iso(log["timestamp"]), "id": str(log["_id"])})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return parse_utc(payload["t"]), ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def count_logs(query: dict, mode: str):
+    """
+    exact     - count_documents on every call
+    estimated - collection metadata for unfiltered queries, otherwise a
+                count_documents result cached for a short TTL
+    none      - no count
+    """
+    if mode == "none":
+        return None
+    log_collection = get_usage_log_collection()
+    if mode == "exact":
+        return await log_collection.count_documents(query)
+
+    cache_key = json.dumps(query, sort_keys=True, default=str)
+    total_count = log_count_cache.get(cache_key)
+    if total_count is None:
+        if query:
+            total_count = await log_collection.count_documents(query)
+        else:
+            total_count = await log_collection.estimated_document_count()
+        log_count_cache.set(cache_key, total_count)
+    return total_count
+
+@router.get("/", dependencies=[Depends(require_admin)])
+async def get_usage_logs(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     user_id: Optional[str] = None,
     license_id: Optional[str] = None,
-    action: Optional[str] = None
+    action: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    count: Literal["exact", "estimated", "none"] = "estimated"
 ):
+    """
+    Newest first. Pass the returned next_cursor back as cursor to get the
+    following page; this costs the same at any depth, unlike skip, which
+    is kept for existing callers.
+    """
     log_collection = get_usage_log_collection()
     
-    query = {}
-    
-    if start_date:
-        try:
-            datetime.fromisoformat(start_date.replace('Z', '+00:00'))
-            query["timestamp"] = {"$gte": start_date}
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid start_date format")
-    
-    if end_date:
-        try:
-            datetime.fromisoformat(end_date.replace('Z', '+00:00'))
-            if "timestamp" in query:
-                query["timestamp"]["$lte"] = end_date
-            else:
-                query["timestamp"] = {"$lte": end_date}
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid end_date format")
+    query = build_log_query(start_date, end_date, user_id, license_id, action)
+    page_query = query
+    if cursor:
+        after_timestamp, after_id = decode_cursor(cursor)
+        page_query = {"$and": [query, {"$or": [
+            {"timestamp": {"$lt": after_timestamp}},
+            {"timestamp": after_timestamp, "_id": {"$lt": after_id}}
+        ]}]}
+        skip = 0
     
-    if user_id:
-        query["user_id"] = user_id
-    if license_id:
-        query["license_id"] = license_id
-    if action:
-        query["action"] = action
+    logs = await log_collection.find(page_query).sort(
+        [("timestamp", -1), ("_id", -1)]
+    ).skip(skip).limit(limit + 1).to_list()
     
-    logs = list(log_collection.find(query).sort("timestamp", -1))
+    next_cursor = None
+    if len(logs) > limit:
+        logs = logs[:limit]
+        next_cursor = encode_cursor(logs[-1])
     
+    return MongoJSONResponse({
+        "logs": logs,
+        "total_count": await count_logs(query, count),
+        "count_mode": count,
+        "limit": limit,
+        "skip": skip,
+        "next_cursor": next_cursor
+    })
+
+async def stream_csv(cursor, chunk_rows: int = EXPORT_CHUNK_ROWS, compress: bool = False):
+    """Yield the export as encoded (optionally gzipped) CSV chunks straight off the cursor"""
     output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=[
-        'timestamp', 'user_id', 'user_name', 'license_id', 'license_no', 
-        'action', 'duration_seconds', 'ip_address', 'user_agent'
-    ])
-    
+    writer = csv.DictWriter(output, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+
+    def take_chunk():
+        data = output.getvalue().encode('utf-8')
+        output.seek(0)
+        output.truncate(0)
+        return compressor.compress(data) if compressor else data
+
     writer.writeheader()
-    for log in logs:
-        log.pop('_id', None)
+    rows = 0
+    async for log in cursor:
+        log["timestamp"] = to_iso(log.get("timestamp"))
         writer.writerow(log)
+        rows += 1
+        if rows >= chunk_rows:
+            chunk = take_chunk()
+            if chunk:
+                yield chunk
+            rows = 0
+
+    chunk = take_chunk()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+@router.get("/download", dependencies=[Depends(require_admin)])
+async def download_usage_logs(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    user_id: Optional[str] = None,
+    license_id: Optional[str] = None,
+    action: Optional[str] = None,
+    gzip: bool = False
+):
+    log_collection = get_usage_log_collection()
     
-    output.seek(0)
+    query = build_log_query(start_date, end_date, user_id, license_id, action)
     
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    logs = log_collection.find(
+        query, {field: 1 for field in CSV_FIELDS} | {"_id": 0}
+    ).sort("timestamp", -1).batch_size(EXPORT_BATCH_SIZE)
+    
+    timestamp = utcnow().strftime("%Y%m%d_%H%M%S")
     filename_parts = ["usage_logs", timestamp]
     if start_date or end_date:
         filename_parts.append(f"from_{start_date or 'all'}_to_{end_date or 'all'}")
     filename = f"{'_'.join(filename_parts)}.csv"
     
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    compress = gzip and "gzip" in request.headers.get("accept-encoding", "")
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    
     return StreamingResponse(
-        io.BytesIO(output.getvalue().encode('utf-8')),
+        stream_csv(logs, compress=compress),
         media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers=headers
     )
 
 @router.get("/stats", dependencies=[Depends(require_admin)])
-def get_usage_stats():
-    log_collection = get_usage_log_collection()
+async def get_usage_stats(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    granularity: Literal["hour", "day"] = "day",
+    series: bool = False
+):
+    """
+    Answered from the hourly/daily rollups rather than the raw logs.
+    Buckets are UTC; start_date is rounded down to its bucket. Defaults to
+    the last 30 days. series=true adds per-bucket counts by action.
+    """
+    try:
+        end = parse_utc(end_date) if end_date else utcnow()
+        start = parse_utc(start_date) if start_date else end - timedelta(days=30)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
     
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    thirty_days_ago_str = thirty_days_ago.isoformat() + "Z"
+    rollup_collection = get_rollup_collection()
+    match = {"$match": {
+        "granularity": granularity,
+        "bucket": {"$gte": bucket_start(start, granularity), "$lte": end}
+    }}
     
     pipeline = [
-        {"$match": {"timestamp": {"$gte": thirty_days_ago_str}}},
+        match,
         {"$group": {
             "_id": "$action",
-            "count": {"$sum": 1}
+            "count": {"$sum": "$count"}
         }}
     ]
     
-    action_stats = list(log_collection.aggregate(pipeline))
+    action_stats = await (await rollup_collection.aggregate(pipeline)).to_list()
     
     user_pipeline = [
-        {"$match": {"timestamp": {"$gte": thirty_days_ago_str}}},
+        match,
+        {"$sort": {"bucket": 1}},
         {"$group": {
             "_id": "$user_id",
-            "user_name": {"$first": "$user_name"},
-            "total_actions": {"$sum": 1},
-            "total_duration": {"$sum": "$duration_seconds"}
+            "user_name": {"$last": "$user_name"},
+            "total_actions": {"$sum": "$count"},
+            "total_duration": {"$sum": "$total_duration"}
         }},
         {"$sort": {"total_actions": -1}},
         {"$limit": 10}
     ]
     
-    user_stats = list(log_collection.aggregate(user_pipeline))
+    user_stats = await (await rollup_collection.aggregate(user_pipeline)).to_list()
     
-    return {
+    result = {
         "action_stats": action_stats,
         "top_users": user_stats,
-        "period": "Last 30 days"
-    }
\ No newline at end of file
+        "period": "Last 30 days" if not start_date and not end_date else f"{to_iso(start)} - {to_iso(end)}",
+        "granularity": granularity
+    }
+    
+    if series:
+        series_pipeline = [
+            match,
+            {"$group": {
+                "_id": {"bucket": "$bucket", "action": "$action"},
+                "count": {"$sum": "$count"}
+            }},
+            {"$sort": {"_id.bucket": 1}}
+        ]
+        result["series"] = [
+            {"bucket": row["_id"]["bucket"], "action": row["_id"]["action"], "count": row["count"]}
+            for row in await (await rollup_collection.aggregate(series_pipeline)).to_list()
+        ]
+    
+    return result
+
+@router.get("/sink-stats", dependencies=[Depends(require_admin)])
+async def get_log_sink_stats():
+    return usage_log_sink.stats()
\ No newline at end of file
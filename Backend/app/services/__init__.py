@@ -0,0 +1,3 @@
+"""
+Background services package
+"""
\ No newline at end of file
@@ -0,0 +1,127 @@
+from datetime import datetime
+from app.utils.time_utils import utcnow
+from app.models.licenses_model import licenses_collection
+from app.services.license_changes import license_seq
+from app.services.license_events import license_events
+from app.routes.usage_log_routes import build_usage_log, log_usage_many
+
+def _elapsed_seconds(field: str, current_time: datetime):
+    return {"$toInt": {"$divide": [{"$subtract": [current_time, f"${field}"]}, 1000]}}
+
+async def _expire(query: dict, projection: dict, update_data: dict):
+    """
+    Find every document matching query in one round trip, then clear them
+    all with one update_many. The query is re-applied to the update so a
+    license extended or released in between is left alone, and only the
+    documents the update actually cleared are returned.
+    """
+    expired = await licenses_collection().find(query, projection).to_list()
+    if not expired:
+        return []
+
+    ids = [license["_id"] for license in expired]
+    async with license_seq.next() as seq:
+        result = await licenses_collection().update_many(
+            {"_id": {"$in": ids}, **query},
+            {"$set": {**update_data, "seq": seq}}
+        )
+
+    if result.modified_count == len(ids):
+        for license_id in ids:
+            license_events.publish("update", license_id, {**update_data, "seq": seq})
+    else:
+        # Some were extended or released in between; announce what is actually
+        # stored and keep only the ones stamped with this sweep's seq
+        cleared = set()
+        current = licenses_collection().find({"_id": {"$in": ids}}, {field: 1 for field in [*update_data, "seq"]})
+        async for license in current:
+            license_events.publish("update", license["_id"], license)
+            if license.get("seq") == seq:
+                cleared.add(license["_id"])
+        expired = [license for license in expired if license["_id"] in cleared]
+    return expired
+
+async def expire_leases(current_time: datetime, user_agent: str = "System Cleanup"):
+    expired = await _expire(
+        {
+            "is_available": False,
+            "expires_at": {"$lt": current_time}
+        },
+        {
+            "No": 1,
+            "current_user": 1,
+            "current_user_name": 1,
+            "duration_seconds": {"$cond": [
+                {"$eq": [{"$type": "$assigned_at"}, "date"]},
+                _elapsed_seconds("assigned_at", current_time),
+                None
+            ]}
+        },
+        {
+            "is_available": True,
+            "current_user": None,
+            "current_user_name": None,
+            "assigned_at": None,
+            "expires_at": None,
+            "reserved_by": None,
+            "reserved_by_name": None,
+            "reserved_at": None,
+            "reservation_expires_at": None,
+            "last_activity": current_time
+        }
+    )
+
+    await log_usage_many([
+        build_usage_log(
+            user_id=license.get("current_user", "system"),
+            user_name=license.get("current_user_name", "") or "System Cleanup",
+            license_id=str(license["_id"]),
+            license_no=license.get("No", ""),
+            action="license_expired",
+            duration_seconds=license.get("duration_seconds"),
+            ip_address=None,
+            user_agent=user_agent,
+            timestamp=current_time
+        )
+        for license in expired
+    ])
+    return len(expired)
+
+async def expire_reservations(current_time: datetime, user_agent: str = "System Cleanup"):
+    expired = await _expire(
+        {
+            "is_available": True,
+            "reserved_by": {"$ne": None},
+            "reservation_expires_at": {"$lt": current_time}
+        },
+        {"No": 1, "reserved_by": 1, "reserved_by_name": 1},
+        {
+            "reserved_by": None,
+            "reserved_by_name": None,
+            "reserved_at": None,
+            "reservation_expires_at": None,
+            "last_activity": current_time
+        }
+    )
+
+    await log_usage_many([
+        build_usage_log(
+            user_id=license.get("reserved_by", "system"),
+            user_name=license.get("reserved_by_name", "System Cleanup"),
+            license_id=str(license["_id"]),
+            license_no=license.get("No", ""),
+            action="reservation_expired",
+            ip_address=None,
+            user_agent=user_agent,
+            timestamp=current_time
+        )
+        for license in expired
+    ])
+    return len(expired)
+
+async def sweep_expired(current_time: datetime = None, user_agent: str = "System Cleanup"):
+    """Release expired leases and clear expired reservations. Returns (leases, reservations) counts."""
+    current_time = current_time or utcnow()
+    expired_licenses_count = await expire_leases(current_time, user_agent)
+    expired_reservations_count = await expire_reservations(current_time, user_agent)
+    return expired_licenses_count, expired_reservations_count
@@ -0,0 +1,103 @@
+import asyncio
+import heapq
+import logging
+import os
+from app.models.licenses_model import licenses_collection
+from app.services.expiry import sweep_expired
+from app.utils.time_utils import parse_utc, utcnow
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_RESYNC_SECONDS = int(os.getenv("EXPIRY_RESYNC_SECONDS", "300"))
+
+
+class ExpiryScheduler:
+    """
+    Keeps a min-heap of pending reservation/lease deadlines and runs the
+    expiry sweep as soon as the earliest one passes. Routes call schedule()
+    whenever they set a deadline; the heap is also rebuilt from Mongo on
+    start and every EXPIRY_RESYNC_SECONDS so deadlines written by other
+    workers are picked up.
+    """
+
+    def __init__(self, resync_seconds: int = EXPIRY_RESYNC_SECONDS):
+        self.resync_seconds = resync_seconds
+        self._heap = []
+        self._wakeup = None
+        self._task = None
+
+    def schedule(self, deadline):
+        heapq.heappush(self._heap, parse_utc(deadline))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def load(self):
+        heap = []
+        cursor = licenses_collection().find(
+            {"$or": [
+                {"reservation_expires_at": {"$ne": None}},
+                {"expires_at": {"$ne": None}}
+            ]},
+            {"reservation_expires_at": 1, "expires_at": 1}
+        )
+        async for license in cursor:
+            for field in ("reservation_expires_at", "expires_at"):
+                value = license.get(field)
+                if not value:
+                    continue
+                try:
+                    heap.append(parse_utc(value))
+                except (TypeError, ValueError):
+                    continue
+        heapq.heapify(heap)
+        self._heap = heap
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_resync = 0.0
+        while True:
+            try:
+                if loop.time() >= next_resync:
+                    await self.load()
+                    next_resync = loop.time() + self.resync_seconds
+
+                now = utcnow()
+                if self._heap and self._heap[0] < now:
+                    while self._heap and self._heap[0] < now:
+                        heapq.heappop(self._heap)
+                    await sweep_expired(now, user_agent="Auto Cleanup")
+                    continue
+
+                timeout = next_resync - loop.time()
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0] - now).total_seconds() + 0.01)
+
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Expiry scheduler iteration failed")
+                await asyncio.sleep(5)
+
+
+expiry_scheduler = ExpiryScheduler()
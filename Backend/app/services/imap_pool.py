@@ -0,0 +1,234 @@
+import asyncio
+import functools
+import imaplib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+IMAP_SERVER = os.getenv("IMAP_SERVER")
+IMAP_MAX_SESSIONS_PER_ACCOUNT = int(os.getenv("IMAP_MAX_SESSIONS_PER_ACCOUNT", "2"))
+IMAP_HEARTBEAT_SECONDS = float(os.getenv("IMAP_HEARTBEAT_SECONDS", "60"))
+IMAP_MAX_IDLE_SECONDS = float(os.getenv("IMAP_MAX_IDLE_SECONDS", "900"))
+IMAP_CHECKOUT_TIMEOUT = float(os.getenv("IMAP_CHECKOUT_TIMEOUT", "30"))
+# Socket timeout for each blocking IMAP read/write
+IMAP_SOCKET_TIMEOUT = float(os.getenv("IMAP_SOCKET_TIMEOUT", "15"))
+# Upper bound on a whole operation (checkout + search + fetches) as seen by the caller
+IMAP_OPERATION_TIMEOUT = float(os.getenv("IMAP_OPERATION_TIMEOUT", "45"))
+IMAP_EXECUTOR_WORKERS = int(os.getenv("IMAP_EXECUTOR_WORKERS", "16"))
+
+# Errors that mean the connection itself is gone and must not be reused
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+class ImapSession:
+    def __init__(self, host: str, email: str, password: str):
+        self.email = email
+        self.password = password
+        self.mail = imaplib.IMAP4_SSL(host, timeout=IMAP_SOCKET_TIMEOUT)
+        self.mail.login(email, password)
+        self.mail.select("inbox")
+        _, data = self.mail.response("UIDVALIDITY")
+        self.uidvalidity = data[0] if data else None
+        self.last_used = time.monotonic()
+
+    def noop(self):
+        self.mail.noop()
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.mail.logout()
+        except Exception:
+            pass
+
+
+class ImapSessionPool:
+    """
+    Authenticated IMAP sessions (INBOX selected) kept per license account.
+    At most max_sessions_per_account are open for an account at once.
+    Idle sessions get a NOOP from the heartbeat task, and sessions that
+    fail it or sit idle too long are closed. A session that breaks mid-use
+    is discarded and the operation is retried once on a fresh connection.
+
+    Blocking IMAP work runs on the pool's own bounded executor (see call())
+    rather than the server's shared threadpool, so a slow mail server can
+    only tie up IMAP_EXECUTOR_WORKERS threads.
+    """
+
+    def __init__(self, host: str = IMAP_SERVER, max_sessions_per_account: int = IMAP_MAX_SESSIONS_PER_ACCOUNT,
+                 heartbeat_seconds: float = IMAP_HEARTBEAT_SECONDS, max_idle_seconds: float = IMAP_MAX_IDLE_SECONDS,
+                 checkout_timeout: float = IMAP_CHECKOUT_TIMEOUT, operation_timeout: float = IMAP_OPERATION_TIMEOUT,
+                 executor_workers: int = IMAP_EXECUTOR_WORKERS):
+        self.host = host
+        self.max_sessions_per_account = max_sessions_per_account
+        self.heartbeat_seconds = heartbeat_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self.checkout_timeout = checkout_timeout
+        self.operation_timeout = operation_timeout
+        self.executor_workers = executor_workers
+        self._executor = None
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._task = None
+        self.counters = {"connects": 0, "reuses": 0, "discarded": 0, "heartbeats": 0, "timeouts": 0}
+
+    def _slot(self, account_id: str):
+        with self._lock:
+            if account_id not in self._slots:
+                self._slots[account_id] = threading.BoundedSemaphore(self.max_sessions_per_account)
+            return self._slots[account_id]
+
+    def _checkout(self, account_id: str, email: str, password: str):
+        while True:
+            with self._lock:
+                idle = self._idle.get(account_id)
+                session = idle.pop() if idle else None
+            if session is None:
+                break
+            if session.email != email or session.password != password:
+                self._discard(session)
+                continue
+            if time.monotonic() - session.last_used > self.heartbeat_seconds:
+                try:
+                    session.noop()
+                except Exception:
+                    self._discard(session)
+                    continue
+            self.counters["reuses"] += 1
+            return session
+
+        self.counters["connects"] += 1
+        return ImapSession(self.host, email, password)
+
+    def _checkin(self, account_id: str, session: ImapSession):
+        session.last_used = time.monotonic()
+        with self._lock:
+            self._idle.setdefault(account_id, []).append(session)
+
+    def _discard(self, session: ImapSession):
+        self.counters["discarded"] += 1
+        session.close()
+
+    @contextmanager
+    def session(self, account_id: str, email: str, password: str):
+        slot = self._slot(account_id)
+        if not slot.acquire(timeout=self.checkout_timeout):
+            raise TimeoutError(f"No IMAP session available for {account_id}")
+        try:
+            session = self._checkout(account_id, email, password)
+            try:
+                yield session
+            except CONNECTION_ERRORS:
+                self._discard(session)
+                session = None
+                raise
+            finally:
+                if session is not None:
+                    self._checkin(account_id, session)
+        finally:
+            slot.release()
+
+    def run(self, account_id: str, email: str, password: str, operation):
+        """Call operation(session) with a pooled session, retrying once if the connection was stale"""
+        try:
+            with self.session(account_id, email, password) as session:
+                return operation(session)
+        except TimeoutError:
+            # A full pool or a stalled server (socket timeouts are OSErrors
+            # too); a retry would only double the wait
+            raise
+        except CONNECTION_ERRORS:
+            with self.session(account_id, email, password) as session:
+                return operation(session)
+
+    async def call(self, fn, *args, timeout: float = None):
+        """
+        Run the blocking fn(*args) on the IMAP executor. Raises TimeoutError
+        once timeout (default operation_timeout) passes; the worker thread
+        itself is freed by the socket timeout.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix="imap")
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        try:
+            return await asyncio.wait_for(future, self.operation_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise
+
+    def heartbeat(self):
+        with self._lock:
+            accounts = list(self._idle)
+
+        for account_id in accounts:
+            slot = self._slot(account_id)
+            # A session only counts against the account while a slot is held
+            while slot.acquire(blocking=False):
+                try:
+                    with self._lock:
+                        idle = self._idle.get(account_id)
+                        if not idle or time.monotonic() - idle[0].last_used <= self.heartbeat_seconds:
+                            break
+                        session = idle.pop(0)
+                    if time.monotonic() - session.last_used > self.max_idle_seconds:
+                        self._discard(session)
+                        continue
+                    try:
+                        session.noop()
+                        self.counters["heartbeats"] += 1
+                    except Exception:
+                        self._discard(session)
+                        continue
+                    self._checkin(account_id, session)
+                finally:
+                    slot.release()
+
+    def close_all(self):
+        with self._lock:
+            sessions = [session for idle in self._idle.values() for session in idle]
+            self._idle = {}
+        for session in sessions:
+            session.close()
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self.call(self.heartbeat)
+            except Exception:
+                logger.exception("IMAP heartbeat failed")
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_heartbeat())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await self.call(self.close_all)
+        except asyncio.TimeoutError:
+            logger.warning("Timed out closing IMAP sessions")
+        self._executor.shutdown(wait=False)
+        self._executor = None
+
+    def stats(self):
+        with self._lock:
+            idle = {account_id: len(sessions) for account_id, sessions in self._idle.items()}
+        return {"idle_sessions": idle, "max_sessions_per_account": self.max_sessions_per_account,
+                "executor_workers": self.executor_workers, **self.counters}
+
+
+imap_pool = ImapSessionPool()
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from app.models.licenses_model import counters_collection, license_tombstones_collection, licenses_collection
+from app.utils.time_utils import utcnow
+
+logger = logging.getLogger(__name__)
+
+LICENSE_SEQ_COUNTER = "all_licenses"
+# Seqs reserved in the counter document per round trip
+LICENSE_SEQ_BLOCK = int(os.getenv("LICENSE_SEQ_BLOCK", "1000"))
+LICENSE_SEQ_HEARTBEAT_SECONDS = float(os.getenv("LICENSE_SEQ_HEARTBEAT_SECONDS", "5"))
+# A lease not renewed for this long belongs to a dead process and can be taken over
+LICENSE_SEQ_LEASE_SECONDS = float(os.getenv("LICENSE_SEQ_LEASE_SECONDS", "20"))
+
+
+class LicenseSequence:
+    """
+    Per-write sequence numbers for all_licenses. Every write stamps the
+    documents it touches with a fresh seq (deletes leave a tombstone
+    carrying one), so /licenses/changes can return just what changed
+    after a client's last seq.
+
+    A seq is taken before its write lands, so a larger seq can become
+    visible first. The feed stays gap-free only if every write is
+    sequenced by the process that serves it, so seqs are handed out in
+    memory by the single process holding the lease on the counter
+    document. start() refuses to run while another live process holds it:
+    the API must run as one worker. Seqs are reserved from the counter in
+    blocks, so a write costs no extra round trip, and a restart continues
+    above everything the previous owner could have handed out.
+    """
+
+    def __init__(self, block: int = LICENSE_SEQ_BLOCK, heartbeat_seconds: float = LICENSE_SEQ_HEARTBEAT_SECONDS,
+                 lease_seconds: float = LICENSE_SEQ_LEASE_SECONDS):
+        self.block = block
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = uuid.uuid4().hex
+        self._issued = None
+        self._ceiling = None
+        self._in_flight = set()
+        self._extend_lock = asyncio.Lock()
+        self._lost = False
+        self._task = None
+
+    async def _claim(self):
+        """The counter document, now owned by this process, or None while a live owner holds it"""
+        now = utcnow()
+        try:
+            return await counters_collection().find_one_and_update(
+                {"_id": LICENSE_SEQ_COUNTER, "$or": [
+                    {"owner": None},
+                    {"heartbeat_at": {"$lt": now - timedelta(seconds=self.lease_seconds)}}
+                ]},
+                {"$set": {"owner": self.owner, "heartbeat_at": now}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return None
+
+    async def _max_stamped(self):
+        highest = 0
+        for collection in (licenses_collection(), license_tombstones_collection()):
+            latest = await collection.find({"seq": {"$ne": None}}, {"seq": 1}).sort("seq", -1).limit(1).to_list()
+            if latest:
+                highest = max(highest, latest[0]["seq"])
+        return highest
+
+    async def _reserve(self, ceiling: int):
+        result = await counters_collection().update_one(
+            {"_id": LICENSE_SEQ_COUNTER, "owner": self.owner},
+            {"$set": {"seq": ceiling, "heartbeat_at": utcnow()}}
+        )
+        if result.matched_count == 0:
+            self._lost = True
+            raise RuntimeError("The license sequence lease was taken over by another process")
+        self._ceiling = ceiling
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # A crashed owner's lease runs out after lease_seconds; a live one never does
+        deadline = asyncio.get_running_loop().time() + self.lease_seconds + self.heartbeat_seconds
+        while (counter := await self._claim()) is None:
+            if asyncio.get_running_loop().time() > deadline:
+                raise RuntimeError(
+                    "Another process holds the license sequence lease; run the API as a single worker"
+                )
+            await asyncio.sleep(1)
+        self._issued = max(counter.get("seq", 0), await self._max_stamped())
+        self._lost = False
+        await self._reserve(self._issued + self.block)
+        self._task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await counters_collection().update_one(
+                {"_id": LICENSE_SEQ_COUNTER, "owner": self.owner}, {"$set": {"owner": None}}
+            )
+        except PyMongoError:
+            logger.exception("Could not release the license sequence lease")
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                result = await counters_collection().update_one(
+                    {"_id": LICENSE_SEQ_COUNTER, "owner": self.owner}, {"$set": {"heartbeat_at": utcnow()}}
+                )
+            except PyMongoError:
+                logger.exception("License sequence heartbeat failed")
+                continue
+            if result.matched_count == 0:
+                self._lost = True
+                logger.error("The license sequence lease was taken over by another process; license writes will fail")
+
+    @asynccontextmanager
+    async def next(self):
+        if self._issued is None:
+            raise RuntimeError("The license sequence has not been started")
+        if self._lost:
+            raise RuntimeError("The license sequence lease was taken over by another process")
+        if self._issued >= self._ceiling:
+            async with self._extend_lock:
+                if self._issued >= self._ceiling:
+                    await self._reserve(self._ceiling + self.block)
+        self._issued += 1
+        seq = self._issued
+        self._in_flight.add(seq)
+        try:
+            yield seq
+        finally:
+            self._in_flight.discard(seq)
+
+    def floor(self):
+        """
+        The highest seq under which every write has landed. Take it before
+        querying and read no further: any write still to come gets a
+        larger seq.
+        """
+        return min([self._issued or 0, *(seq - 1 for seq in self._in_flight)])
+
+
+license_seq = LicenseSequence()
+
+
+async def record_deletion(license_id, seq: int):
+    await license_tombstones_collection().insert_one(
+        {"license_id": str(license_id), "seq": seq, "deleted_at": utcnow()}
+    )
+
+
+async def changes_since(since: int, through: int, limit: int):
+    """
+    Licenses written and ids deleted after `since` and at or below
+    `through` (a floor() taken before this call), oldest first. A batch
+    update stamps many documents with one seq, so a page is never cut in
+    the middle of a seq. Returns (licenses, deleted_ids, next_since).
+    """
+    seq_range = {"$gt": since, "$lte": through}
+    licenses = await licenses_collection().find({"seq": seq_range}).sort("seq", 1).limit(limit).to_list()
+    if len(licenses) == limit:
+        last_seq = licenses[-1]["seq"]
+        seen = [license["_id"] for license in licenses if license["seq"] == last_seq]
+        licenses += await licenses_collection().find({"seq": last_seq, "_id": {"$nin": seen}}).to_list()
+        through = last_seq
+
+    tombstones = await license_tombstones_collection().find(
+        {"seq": {"$gt": since, "$lte": through}}, {"license_id": 1}
+    ).to_list()
+    return licenses, [tombstone["license_id"] for tombstone in tombstones], max(since, through)
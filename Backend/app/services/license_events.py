@@ -0,0 +1,196 @@
+import asyncio
+import itertools
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from app.database import get_client
+from app.models.licenses_model import licenses_collection
+from app.utils.time_utils import to_iso
+
+logger = logging.getLogger(__name__)
+
+# auto: change streams when connected to a replica set, otherwise in-process publishing
+LICENSE_EVENTS_SOURCE = os.getenv("LICENSE_EVENTS_SOURCE", "auto")
+LICENSE_EVENTS_BACKLOG = int(os.getenv("LICENSE_EVENTS_BACKLOG", "1000"))
+LICENSE_EVENTS_QUEUE_SIZE = int(os.getenv("LICENSE_EVENTS_QUEUE_SIZE", "500"))
+
+# Never pushed to browsers; served only by GET /licenses/{id}/credentials
+PRIVATE_FIELDS = {"password", "gmail", "mail_password"}
+
+# Tells a subscriber it missed events and should refetch the full list
+RESET = {"type": "reset"}
+
+
+def _wire(value):
+    if isinstance(value, datetime):
+        return to_iso(value)
+    if isinstance(value, ObjectId):
+        return str(value)
+    return value
+
+
+def license_delta(fields: dict):
+    return {
+        key: _wire(value) for key, value in fields.items()
+        if key != "_id" and key.split(".")[0] not in PRIVATE_FIELDS
+    }
+
+
+class LicenseEventBus:
+    """
+    Fan-out of per-license changes to /licenses/events subscribers.
+
+    Against a replica set the bus tails a change stream on all_licenses,
+    so writes from every worker (and the expiry sweep) arrive in commit
+    order. Otherwise the routes publish the fields they just $set, and only
+    this process's writes are seen. Recent events are kept so a client that
+    reconnects with Last-Event-ID can catch up. A subscriber that falls too
+    far behind gets a reset event instead.
+
+    The sequence of the last event doubles as the collection version
+    behind the ETag on the license read endpoints. Writes that bypass the
+    bus (other workers, in local mode) move it through bump() once the
+    license snapshot's periodic reload finds them.
+    """
+
+    def __init__(self, source: str = LICENSE_EVENTS_SOURCE, backlog: int = LICENSE_EVENTS_BACKLOG,
+                 queue_size: int = LICENSE_EVENTS_QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.mode = "local"
+        self.stream_id = uuid.uuid4().hex[:8]
+        self._seq = itertools.count(1)
+        self.version = 0
+        self._backlog = deque(maxlen=backlog)
+        self._subscribers = set()
+        self._listeners = []
+        self._task = None
+
+    def add_listener(self, callback):
+        """callback(event_type, license_id, fields) runs for every event, with the unconverted field values"""
+        self._listeners.append(callback)
+
+    def publish(self, event_type: str, license_id, fields: dict = None):
+        """Announce a write this process just made. Ignored when a change stream is the source."""
+        if self.mode == "local":
+            self._emit(event_type, license_id, fields)
+
+    def _emit(self, event_type: str, license_id, fields: dict = None):
+        self.version = next(self._seq)
+        event = {"id": f"{self.stream_id}-{self.version}", "type": event_type, "license_id": str(license_id)}
+        if fields is not None:
+            event["fields"] = license_delta(fields)
+        self._backlog.append(event)
+        for callback in self._listeners:
+            try:
+                callback(event_type, license_id, fields)
+            except Exception:
+                logger.exception("License event listener failed")
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESET)
+
+    def bump(self):
+        """Move the version for a change that was found outside the event stream"""
+        self.version = next(self._seq)
+
+    def etag(self):
+        return f'"{self.stream_id}-{self.version}"'
+
+    def _replay(self, last_event_id: str):
+        """Events after last_event_id, or None when they are no longer all in the backlog"""
+        stream_id, _, seq = last_event_id.rpartition("-")
+        if stream_id != self.stream_id or not seq.isdigit():
+            return None
+        seq = int(seq)
+        events = [event for event in self._backlog if int(event["id"].rpartition("-")[2]) > seq]
+        oldest = int(self._backlog[0]["id"].rpartition("-")[2]) if self._backlog else seq + 1
+        if oldest > seq + 1:
+            return None
+        return events
+
+    def subscribe(self, last_event_id: str = None):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if last_event_id:
+            events = self._replay(last_event_id)
+            if events is None or len(events) >= self.queue_size:
+                queue.put_nowait(RESET)
+            else:
+                for event in events:
+                    queue.put_nowait(event)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _apply_change(self, change: dict):
+        operation = change["operationType"]
+        license_id = change["documentKey"]["_id"]
+        if operation == "insert":
+            self._emit("insert", license_id, change["fullDocument"])
+        elif operation == "replace":
+            self._emit("update", license_id, change["fullDocument"])
+        elif operation == "update":
+            description = change["updateDescription"]
+            fields = dict(description.get("updatedFields", {}))
+            fields.update({field: None for field in description.get("removedFields", [])})
+            self._emit("update", license_id, fields)
+        elif operation == "delete":
+            self._emit("delete", license_id)
+
+    async def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                stream = await licenses_collection().watch(resume_after=resume_token)
+                async with stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._apply_change(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError:
+                logger.exception("License change stream failed, resuming")
+                await asyncio.sleep(5)
+
+    async def _replica_set(self):
+        try:
+            hello = await get_client().admin.command("hello")
+        except PyMongoError:
+            logger.exception("Could not determine MongoDB topology")
+            return False
+        return "setName" in hello
+
+    async def start(self):
+        if self._task is not None or self.source == "local":
+            return
+        if await self._replica_set():
+            self.mode = "change_stream"
+            self._task = asyncio.create_task(self._watch())
+        elif self.source == "change_stream":
+            logger.warning("Change streams need a replica set; publishing license events in-process")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.mode = "local"
+
+    def stats(self):
+        return {"mode": self.mode, "subscribers": len(self._subscribers), "backlog": len(self._backlog)}
+
+
+license_events = LicenseEventBus()
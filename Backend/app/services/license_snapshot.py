@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import time
+from bson import ObjectId
+from app.models.licenses_model import licenses_collection
+from app.services.license_events import PRIVATE_FIELDS, license_events
+from app.utils.json_response import dumps
+
+logger = logging.getLogger(__name__)
+
+# Reload from Mongo this often even without local writes, to pick up other workers' changes
+LICENSE_SNAPSHOT_MAX_AGE_SECONDS = float(os.getenv("LICENSE_SNAPSHOT_MAX_AGE_SECONDS", "30"))
+# How long a read waits on a required reload before serving the previous snapshot as stale
+LICENSE_SNAPSHOT_REFRESH_TIMEOUT = float(os.getenv("LICENSE_SNAPSHOT_REFRESH_TIMEOUT", "2"))
+
+
+def normalize_license(license: dict):
+    """
+    API shape of a license document: the legacy is_avaliable spelling
+    resolved and credentials removed (see GET /licenses/{id}/credentials).
+    _id stays an ObjectId; app.utils.json_response writes it as a string.
+    """
+    for field in PRIVATE_FIELDS:
+        license.pop(field, None)
+    if "is_avaliable" in license:
+        license["is_available"] = license.pop("is_avaliable")
+    if "is_available" not in license:
+        license["is_available"] = True
+    return license
+
+
+class LicenseSnapshot:
+    """
+    Process-local copy of the GET /licenses/ body. Documents are held
+    normalized, keyed by id, and every license event (this worker's writes,
+    or the change stream) is applied to them write-through. The JSON bytes
+    are rebuilt once per change, not per request.
+
+    A full reload runs on first use, whenever an event cannot be applied
+    in place, and every max_age seconds from a background task started
+    with the app, so writes this process never saw as events move the
+    ETag even while clients only revalidate.
+    If a needed reload fails or takes longer than refresh_timeout, the
+    last good snapshot is served flagged as stale and the reload carries
+    on in the background.
+    """
+
+    def __init__(self, max_age: float = LICENSE_SNAPSHOT_MAX_AGE_SECONDS,
+                 refresh_timeout: float = LICENSE_SNAPSHOT_REFRESH_TIMEOUT):
+        self.max_age = max_age
+        self.refresh_timeout = refresh_timeout
+        self._docs = None
+        self._body = None
+        self._loaded_at = 0.0
+        self._dirty = True
+        self._refresh = None
+        self._replay = None
+        self._task = None
+        self.counters = {"reads": 0, "reloads": 0, "reload_failures": 0, "stale_reads": 0, "applied_events": 0,
+                         "replayed_events": 0}
+
+    @staticmethod
+    def _apply_to(docs: dict, event_type: str, license_id, fields: dict = None):
+        """Apply one event to docs in place. False when it can't be applied without a reload."""
+        key = str(license_id)
+        if event_type == "delete":
+            docs.pop(key, None)
+        elif fields is None or any("." in field for field in fields):
+            return False
+        elif key in docs:
+            docs[key] = normalize_license({**docs[key], **fields})
+        elif event_type == "insert":
+            # Keep _id as stored, so the copy compares equal to a reload
+            license_id = fields.get("_id", license_id)
+            if not isinstance(license_id, ObjectId) and ObjectId.is_valid(license_id):
+                license_id = ObjectId(license_id)
+            docs[key] = normalize_license({**fields, "_id": license_id})
+        else:
+            return False
+        return True
+
+    def apply(self, event_type: str, license_id, fields: dict = None):
+        if self._replay is not None:
+            self._replay.append((event_type, license_id, fields))
+        if self._docs is None:
+            return
+        if not self._apply_to(self._docs, event_type, license_id, fields):
+            self._dirty = True
+            return
+        self._body = None
+        self.counters["applied_events"] += 1
+
+    async def _load(self):
+        # Events that land mid-read may or may not be in the result. They
+        # are replayed in order on top of it; every event is idempotent.
+        self._replay = []
+        try:
+            licenses = await licenses_collection().find().to_list()
+        finally:
+            replay, self._replay = self._replay, None
+        docs = {str(license["_id"]): normalize_license(license) for license in licenses}
+        # Ids whose events could not be applied, unless a later delete settles them
+        unresolved = set()
+        for event_type, license_id, fields in replay:
+            if event_type == "delete":
+                unresolved.discard(str(license_id))
+            if not self._apply_to(docs, event_type, license_id, fields):
+                unresolved.add(str(license_id))
+        if self._docs is not None and docs != self._docs:
+            # Changes this process never saw as events, e.g. another worker's
+            # writes; move the ETag so clients don't keep revalidating old data
+            license_events.bump()
+        self._docs = docs
+        self._body = None
+        self._loaded_at = time.monotonic()
+        self._dirty = bool(unresolved)
+        self.counters["reloads"] += 1
+        self.counters["replayed_events"] += len(replay)
+
+    def _on_reload_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self.counters["reload_failures"] += 1
+            logger.error("License snapshot reload failed", exc_info=task.exception())
+
+    def _reload(self):
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.create_task(self._load())
+            self._refresh.add_done_callback(self._on_reload_done)
+        return self._refresh
+
+    def _serialize(self):
+        if self._body is None:
+            docs = list(self._docs.values())
+            self._body = dumps({"total_licensess": len(docs), "licensess": docs})
+        return self._body
+
+    async def get(self):
+        """Returns (json_bytes, stale). Raises only when no snapshot was ever loaded."""
+        self.counters["reads"] += 1
+        if self._docs is None:
+            await asyncio.shield(self._reload())
+        elif self._dirty:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._reload()), self.refresh_timeout)
+            except Exception:
+                self.counters["stale_reads"] += 1
+                return self._serialize(), True
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            self._reload()
+        return self._serialize(), False
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.shield(self._reload())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Already counted and logged by _on_reload_done
+                pass
+            await asyncio.sleep(self.max_age)
+
+    def stats(self):
+        return {
+            "loaded": self._docs is not None,
+            "size": len(self._docs) if self._docs is not None else 0,
+            "age_seconds": round(time.monotonic() - self._loaded_at, 1) if self._docs is not None else None,
+            "dirty": self._dirty,
+            **self.counters
+        }
+
+
+license_snapshot = LicenseSnapshot()
+license_events.add_listener(license_snapshot.apply)
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from pymongo.errors import AutoReconnect, BulkWriteError, ConnectionFailure, NetworkTimeout
+from app.models.usage_log_model import get_usage_log_collection
+from app.services.usage_rollups import apply_rollups
+
+logger = logging.getLogger(__name__)
+
+USAGE_LOG_QUEUE_SIZE = int(os.getenv("USAGE_LOG_QUEUE_SIZE", "10000"))
+USAGE_LOG_BATCH_SIZE = int(os.getenv("USAGE_LOG_BATCH_SIZE", "500"))
+USAGE_LOG_FLUSH_INTERVAL = float(os.getenv("USAGE_LOG_FLUSH_INTERVAL", "1.0"))
+USAGE_LOG_OVERFLOW_POLICY = os.getenv("USAGE_LOG_OVERFLOW_POLICY", "drop_oldest")
+# Ceiling for the doubling pause between flushes while the database is unreachable
+USAGE_LOG_RETRY_MAX_SECONDS = float(os.getenv("USAGE_LOG_RETRY_MAX_SECONDS", "30"))
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+# Only these put a batch back in the queue; any other error drops it
+TRANSIENT_ERRORS = (ConnectionFailure, AutoReconnect, NetworkTimeout)
+
+
+class UsageLogSink:
+    """
+    Buffers usage-log documents in a bounded in-memory queue and writes
+    them with insert_many(ordered=False) from a background task, either
+    when batch_size entries are waiting or every flush_interval seconds.
+    Each written batch is then folded into the usage rollups. A batch
+    that fails on a connection error is put back and the writer backs
+    off, doubling up to retry_max seconds; any other failure drops it.
+
+    overflow_policy decides what happens when the queue is full:
+      drop_oldest - evict the oldest queued entry to make room
+      drop_newest - discard the entry being added
+      block       - make the caller wait until the writer frees space
+    """
+
+    def __init__(self, max_queue: int = USAGE_LOG_QUEUE_SIZE, batch_size: int = USAGE_LOG_BATCH_SIZE,
+                 flush_interval: float = USAGE_LOG_FLUSH_INTERVAL, overflow_policy: str = USAGE_LOG_OVERFLOW_POLICY,
+                 retry_max: float = USAGE_LOG_RETRY_MAX_SECONDS):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {OVERFLOW_POLICIES}")
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.retry_max = retry_max
+        self._queue = deque()
+        self._wakeup = None
+        self._space = None
+        self._task = None
+        self._stopping = False
+        self.counters = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0, "requeued": 0}
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def put(self, document: dict):
+        if len(self._queue) >= self.max_queue:
+            if self.overflow_policy == "drop_newest":
+                self.counters["dropped"] += 1
+                return
+            if self.overflow_policy == "drop_oldest":
+                self._queue.popleft()
+                self.counters["dropped"] += 1
+            else:
+                while len(self._queue) >= self.max_queue and self.running:
+                    self._wakeup.set()
+                    self._space.clear()
+                    await self._space.wait()
+
+        self._queue.append(document)
+        self.counters["enqueued"] += 1
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    async def put_many(self, documents: list):
+        for document in documents:
+            await self.put(document)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the writer and flush whatever is still queued"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush(requeue_on_error=False)
+        self._space.set()
+        if self._queue:
+            self.counters["failed"] += len(self._queue)
+            self._queue.clear()
+
+    async def flush(self, requeue_on_error: bool = True):
+        """Write everything queued. Returns False when a batch hit a connection error."""
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            try:
+                await get_usage_log_collection().insert_many(batch, ordered=False)
+                self.counters["written"] += len(batch)
+                written = batch
+            except BulkWriteError as e:
+                inserted = e.details.get("nInserted", 0)
+                self.counters["written"] += inserted
+                self.counters["failed"] += len(batch) - inserted
+                logger.warning("Usage log batch partially failed: %s", e.details.get("writeErrors"))
+                failed_indexes = {error["index"] for error in e.details.get("writeErrors", [])}
+                written = [entry for i, entry in enumerate(batch) if i not in failed_indexes]
+            except TRANSIENT_ERRORS:
+                logger.warning("Usage log batch of %d could not reach the database", len(batch), exc_info=True)
+                room = self.max_queue - len(self._queue)
+                if requeue_on_error and room > 0:
+                    # Keep the entries for the next flush; whatever doesn't fit is lost
+                    self._queue.extendleft(reversed(batch[:room]))
+                    self.counters["requeued"] += min(len(batch), room)
+                    self.counters["failed"] += max(len(batch) - room, 0)
+                else:
+                    self.counters["failed"] += len(batch)
+                return False
+            except Exception:
+                logger.exception("Usage log batch of %d dropped", len(batch))
+                self.counters["failed"] += len(batch)
+                written = []
+            finally:
+                self.counters["flushes"] += 1
+
+            self._space.set()
+            if written:
+                try:
+                    await apply_rollups(written)
+                except Exception:
+                    # The logs themselves are stored; don't write them again
+                    logger.exception("Usage rollup update failed for %d entries", len(written))
+        return True
+
+    async def _backoff(self, seconds: float):
+        """Sleep out a retry delay; wakeups from put() don't cut it short, stop() does"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while not self._stopping and loop.time() < deadline:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=deadline - loop.time())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _run(self):
+        delay = 0.0
+        while not self._stopping:
+            if delay:
+                await self._backoff(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            if await self.flush():
+                delay = 0.0
+            else:
+                delay = min(max(delay * 2, self.flush_interval), self.retry_max)
+
+    def stats(self):
+        return {
+            "queued": len(self._queue),
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "overflow_policy": self.overflow_policy,
+            **self.counters,
+        }
+
+
+usage_log_sink = UsageLogSink()
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+import re
+from app.models.licenses_model import licenses_collection
+
+logger = logging.getLogger(__name__)
+
+MAIL_ACCOUNTS_REFRESH_SECONDS = int(os.getenv("MAIL_ACCOUNTS_REFRESH_SECONDS", "300"))
+
+ENV_ACCOUNT_PATTERN = re.compile(r"^LICENSE(\d+)_EMAIL$")
+
+
+def account_key(license_no):
+    """The OTP routing id for a license number, matching the frontend's `license${parseInt(No)}`"""
+    try:
+        return f"license{int(license_no)}"
+    except (TypeError, ValueError):
+        return None
+
+
+def env_accounts():
+    """Legacy LICENSE{n}_EMAIL / LICENSE{n}_PASSWORD accounts, used only where no license document defines one"""
+    accounts = {}
+    for name, value in os.environ.items():
+        match = ENV_ACCOUNT_PATTERN.match(name)
+        if match and value:
+            accounts[f"license{int(match.group(1))}"] = {
+                "email": value,
+                "password": os.getenv(f"LICENSE{match.group(1)}_PASSWORD")
+            }
+    return accounts
+
+
+class MailAccountRegistry:
+    """
+    Mailbox credentials for OTP lookups, indexed by license routing id and
+    sourced from the gmail/mail_password fields in all_licenses. The
+    license routes apply their own writes through upsert()/remove(); a
+    periodic reload picks up writes made by other workers. The index is
+    swapped wholesale on every change, so readers never need a lock.
+    Listeners get the set of routing ids whose account changed.
+    """
+
+    def __init__(self, refresh_seconds: int = MAIL_ACCOUNTS_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._accounts = {}
+        self._doc_keys = {}
+        self._listeners = []
+        self._task = None
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def get(self, license_id: str):
+        return self._accounts.get(license_id)
+
+    def accounts(self):
+        return dict(self._accounts)
+
+    def _swap(self, accounts: dict, doc_keys: dict):
+        previous = self._accounts
+        self._accounts = accounts
+        self._doc_keys = doc_keys
+        changed = {key for key in previous.keys() | accounts.keys() if previous.get(key) != accounts.get(key)}
+        if changed:
+            for callback in self._listeners:
+                try:
+                    callback(changed)
+                except Exception:
+                    logger.exception("Mail account listener failed")
+
+    @staticmethod
+    def _entry(license: dict):
+        key = account_key(license.get("No"))
+        if key is None or not license.get("gmail") or not license.get("mail_password"):
+            return None, None
+        return key, {"email": license["gmail"], "password": license["mail_password"], "doc_id": str(license["_id"])}
+
+    async def load(self):
+        accounts = env_accounts()
+        key_docs = {}
+        cursor = licenses_collection().find({}, {"No": 1, "gmail": 1, "mail_password": 1})
+        async for license in cursor:
+            key, entry = self._entry(license)
+            if key is None:
+                continue
+            if key in key_docs:
+                logger.warning("Duplicate license No for %s; keeping %s", key, entry["doc_id"])
+            accounts[key] = entry
+            key_docs[key] = entry["doc_id"]
+        self._swap(accounts, {doc_id: key for key, doc_id in key_docs.items()})
+
+    def upsert(self, license: dict):
+        """Apply an inserted or edited license document (needs _id, No, gmail, mail_password)"""
+        accounts = dict(self._accounts)
+        doc_keys = dict(self._doc_keys)
+        doc_id = str(license["_id"])
+        old_key = doc_keys.pop(doc_id, None)
+        if old_key is not None:
+            accounts.pop(old_key, None)
+        key, entry = self._entry(license)
+        if key is not None:
+            accounts[key] = entry
+            doc_keys[doc_id] = key
+        self._swap(accounts, doc_keys)
+
+    def remove(self, doc_id):
+        doc_id = str(doc_id)
+        if doc_id not in self._doc_keys:
+            return
+        accounts = dict(self._accounts)
+        doc_keys = dict(self._doc_keys)
+        accounts.pop(doc_keys.pop(doc_id), None)
+        self._swap(accounts, doc_keys)
+
+    async def start(self):
+        if self._task is not None:
+            return
+        try:
+            await self.load()
+        except Exception:
+            logger.exception("Initial mail account load failed")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.load()
+            except Exception:
+                logger.exception("Mail account reload failed")
+
+
+mail_accounts = MailAccountRegistry()
@@ -0,0 +1,134 @@
+import email
+import os
+import re
+import threading
+from datetime import date, timedelta
+from email.utils import parsedate_to_datetime
+from zoneinfo import ZoneInfo
+from app.utils.time_utils import to_iso
+
+OTP_PATTERN = re.compile(r"\b\d{6}\b")
+OTP_FETCH_BYTES = int(os.getenv("OTP_FETCH_BYTES", "16384"))
+OTP_LOOKBACK_DAYS = int(os.getenv("OTP_LOOKBACK_DAYS", "7"))
+
+HEADER_FIELDS = "DATE FROM TO SUBJECT CONTENT-TYPE CONTENT-TRANSFER-ENCODING MIME-VERSION"
+
+
+class MailboxCursor:
+    """What has already been scanned in one mailbox for one subject keyword"""
+
+    def __init__(self, uidvalidity):
+        self.uidvalidity = uidvalidity
+        self.last_uid = 0
+        self.latest = None
+        self.latest_uid = 0
+
+
+_cursors = {}
+_cursors_lock = threading.Lock()
+
+
+def reset_cursors(license_id: str):
+    """Drop scan state for a license, e.g. after its mailbox credentials changed"""
+    with _cursors_lock:
+        for key in [key for key in _cursors if key[0] == license_id]:
+            del _cursors[key]
+
+
+def _message_body(message):
+    if message.is_multipart():
+        for part in message.walk():
+            if part.get_content_type() in ("text/html", "text/plain"):
+                payload = part.get_payload(decode=True)
+                return payload.decode(errors="replace") if payload else ""
+        return ""
+    payload = message.get_payload(decode=True)
+    return payload.decode(errors="replace") if payload else ""
+
+
+def parse_otp_message(raw_message: bytes, license_id: str):
+    message = email.message_from_bytes(raw_message)
+    otp_match = OTP_PATTERN.search(_message_body(message))
+    if not otp_match:
+        return None
+
+    email_datetime = parsedate_to_datetime(message["Date"])
+    thai_time = email_datetime.astimezone(ZoneInfo("Asia/Bangkok"))
+
+    return {
+        "otp": otp_match.group(0),
+        "from": message["From"],
+        "to": message.get("To", ""),
+        "subject": message["Subject"],
+        "date": thai_time.strftime("%Y-%m-%d %H:%M:%S"),
+        "timestamp": to_iso(email_datetime),
+        "license_id": license_id
+    }
+
+
+def fetch_partial(mail, uid: bytes):
+    """Fetch just the headers we need plus the first OTP_FETCH_BYTES of the body"""
+    result, data = mail.uid(
+        "FETCH", uid,
+        f"(BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})] BODY.PEEK[TEXT]<0.{OTP_FETCH_BYTES}>)"
+    )
+    if result != "OK":
+        return None
+
+    header, body = b"", b""
+    for item in data:
+        if not isinstance(item, tuple):
+            continue
+        if b"HEADER.FIELDS" in item[0]:
+            header = item[1]
+        elif b"BODY[TEXT]" in item[0]:
+            body = item[1]
+    return header.rstrip(b"\r\n") + b"\r\n\r\n" + body
+
+
+def scan_for_otp(session, license_id: str, subject_keyword: str):
+    """
+    Find the newest OTP mail for subject_keyword, only looking at messages
+    that arrived since the previous scan of this mailbox (UID SEARCH
+    UID n:*). The first scan, or one after UIDVALIDITY changes, is bounded
+    to the last OTP_LOOKBACK_DAYS days. Each candidate message costs one
+    bounded partial FETCH instead of its full RFC822 source.
+    """
+    mail = session.mail
+    key = (license_id, subject_keyword)
+    with _cursors_lock:
+        cursor = _cursors.get(key)
+        if cursor is None or cursor.uidvalidity != session.uidvalidity:
+            cursor = _cursors[key] = MailboxCursor(session.uidvalidity)
+
+    if cursor.last_uid:
+        criteria = f'(UID {cursor.last_uid + 1}:* TEXT "{subject_keyword}")'
+    else:
+        since = (date.today() - timedelta(days=OTP_LOOKBACK_DAYS)).strftime("%d-%b-%Y")
+        criteria = f'(SINCE {since} TEXT "{subject_keyword}")'
+
+    result, data = mail.uid("SEARCH", None, criteria)
+    if result != "OK":
+        raise RuntimeError("Error searching inbox")
+
+    # "n:*" still returns the newest message when nothing is newer than n
+    uids = [uid for uid in data[0].split() if int(uid) > cursor.last_uid]
+
+    found, found_uid = None, 0
+    for uid in sorted(uids, key=int, reverse=True):
+        raw_message = fetch_partial(mail, uid)
+        if raw_message is None:
+            continue
+        found = parse_otp_message(raw_message, license_id)
+        if found:
+            found_uid = int(uid)
+            break
+
+    with _cursors_lock:
+        if uids:
+            cursor.last_uid = max(cursor.last_uid, max(int(uid) for uid in uids))
+        # An overlapping scan (watcher vs on-demand) may have finished first
+        # with a newer message; never move latest back to an older one
+        if found and found_uid > cursor.latest_uid:
+            cursor.latest, cursor.latest_uid = found, found_uid
+        return cursor.latest
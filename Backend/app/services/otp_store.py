@@ -0,0 +1,89 @@
+import asyncio
+import threading
+from app.utils.time_utils import parse_utc, utcnow
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class OtpStore:
+    """
+    Latest OTP seen per license, published by the mailbox watchers (from
+    their threads) and by on-demand lookups. Reads are a dict lookup, and
+    long-poll requests can await the next publish for a license.
+    """
+
+    def __init__(self):
+        self._latest = {}
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def publish(self, license_id: str, otp: dict):
+        """
+        Record otp for license_id. Returns True if it replaced the stored
+        one; an OTP sent before the stored one (from a slower overlapping
+        scan) is ignored.
+        """
+        with self._lock:
+            current = self._latest.get(license_id)
+            now = utcnow()
+            if current is not None and current["otp"] == otp:
+                current["checked_at"] = now
+                return False
+            sent_at = parse_utc(otp["timestamp"]) if otp.get("timestamp") else now
+            if current is not None and sent_at < current["sent_at"]:
+                current["checked_at"] = now
+                return False
+            self._latest[license_id] = {"otp": otp, "sent_at": sent_at, "received_at": now, "checked_at": now}
+            waiters = self._waiters.pop(license_id, set())
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        return True
+
+    def get(self, license_id: str):
+        with self._lock:
+            entry = self._latest.get(license_id)
+            return dict(entry) if entry else None
+
+    def discard(self, license_id: str):
+        with self._lock:
+            self._latest.pop(license_id, None)
+
+    def has_waiters(self, license_id: str):
+        with self._lock:
+            return bool(self._waiters.get(license_id))
+
+    async def wait_for_newer(self, license_id: str, after, timeout: float):
+        """
+        Return the entry for license_id once its OTP was sent after `after`
+        (any OTP if after is None), or None when timeout runs out first.
+        The waiter is registered before the first await, so a caller that
+        starts a poller right before calling this cannot miss its publish.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._lock:
+                entry = self._latest.get(license_id)
+                if entry and (after is None or entry["sent_at"] > after):
+                    return dict(entry)
+                waiter = (loop, loop.create_future())
+                self._waiters.setdefault(license_id, set()).add(waiter)
+
+            try:
+                await asyncio.wait_for(waiter[1], deadline - loop.time())
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                with self._lock:
+                    waiters = self._waiters.get(license_id)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            del self._waiters[license_id]
+
+
+otp_store = OtpStore()
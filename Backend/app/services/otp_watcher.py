@@ -0,0 +1,189 @@
+import itertools
+import logging
+import os
+import select
+import ssl
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+from app.services.imap_pool import IMAP_SERVER, ImapSession
+from app.services.otp_reader import scan_for_otp
+from app.services.otp_store import otp_store
+
+logger = logging.getLogger(__name__)
+
+OTP_WATCHERS_ENABLED = os.getenv("OTP_WATCHERS_ENABLED", "true").lower() == "true"
+OTP_WATCH_SUBJECT = os.getenv("OTP_WATCH_SUBJECT", "Your one-time security code")
+# RFC 2177 servers may drop an IDLE after 30 minutes; re-issue well before
+OTP_IDLE_REFRESH_SECONDS = float(os.getenv("OTP_IDLE_REFRESH_SECONDS", "300"))
+OTP_WATCH_RETRY_SECONDS = float(os.getenv("OTP_WATCH_RETRY_SECONDS", "30"))
+# Each watcher is a thread with its own IMAP connection; mailboxes past the
+# cap are served by on-demand lookups through the pooled IMAP executor
+OTP_WATCHERS_MAX = int(os.getenv("OTP_WATCHERS_MAX", "50"))
+
+_tags = itertools.count(1)
+
+
+def _buffered(mail):
+    """Whether imaplib's read buffer already holds unread bytes, without blocking"""
+    timeout = mail.sock.gettimeout()
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (ssl.SSLWantReadError, BlockingIOError):
+        return False
+    finally:
+        mail.sock.settimeout(timeout)
+
+
+def idle_until_change(mail, timeout: float, stop_event: threading.Event):
+    """
+    Issue IMAP IDLE and block until the server says anything, timeout
+    elapses or stop_event is set, then end the IDLE with DONE. Returns True
+    when any untagged line other than a keepalive was seen.
+    """
+    tag = f"W{next(_tags)}".encode()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        raise RuntimeError(f"IDLE rejected: {line!r}")
+
+    # select() can't see lines already sitting in imaplib's read buffer
+    # (e.g. an EXISTS that came in the same read as "+ idling"), so check
+    # that first, then stop idling on the first readable byte and classify
+    # everything up to the tagged completion
+    deadline = time.monotonic() + timeout
+    sock = mail.sock
+    while not stop_event.is_set() and not _buffered(mail):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or sock.pending():
+            break
+        readable, _, _ = select.select([sock], [], [], min(remaining, 1.0))
+        if readable:
+            break
+
+    mail.send(b"DONE\r\n")
+    changed = False
+    while True:
+        line = mail.readline()
+        if not line:
+            raise EOFError("IMAP connection closed while ending IDLE")
+        if line.startswith(tag):
+            return changed
+        if not line.startswith(b"* OK"):
+            changed = True
+
+
+class MailboxWatcher(threading.Thread):
+    """Holds one IDLE connection to a license mailbox and publishes new OTPs to the store"""
+
+    def __init__(self, license_id: str, email: str, password: str, subject_keyword: str = OTP_WATCH_SUBJECT):
+        super().__init__(name=f"otp-watcher-{license_id}", daemon=True)
+        self.license_id = license_id
+        self.email = email
+        self.password = password
+        self.subject_keyword = subject_keyword
+        self.connected = False
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _scan(self, session):
+        otp = scan_for_otp(session, self.license_id, self.subject_keyword)
+        if otp:
+            otp_store.publish(self.license_id, otp)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            session = None
+            try:
+                session = ImapSession(IMAP_SERVER, self.email, self.password)
+                self._scan(session)
+                self.connected = True
+                while not self._stop_event.is_set():
+                    if idle_until_change(session.mail, OTP_IDLE_REFRESH_SECONDS, self._stop_event):
+                        self._scan(session)
+                    else:
+                        # Re-issued IDLE on the next pass; the NOOP catches a half-open socket
+                        session.noop()
+            except Exception:
+                if not self._stop_event.is_set():
+                    logger.exception("OTP watcher for %s failed, reconnecting", self.license_id)
+            finally:
+                self.connected = False
+                if session is not None:
+                    session.close()
+            self._stop_event.wait(OTP_WATCH_RETRY_SECONDS)
+
+
+def _license_number(license_id: str):
+    digits = license_id[len("license"):]
+    return (0, int(digits)) if digits.isdigit() else (1, license_id)
+
+
+class OtpWatcherManager:
+    """
+    Runs IDLE watchers for at most max_watchers mailboxes, lowest license
+    numbers first. The rest are not watched, so their lookups fall back to
+    polling through the IMAP pool.
+    """
+
+    def __init__(self, max_watchers: int = OTP_WATCHERS_MAX):
+        self.max_watchers = max_watchers
+        self._watchers = {}
+        self._unwatched = 0
+        self._running = False
+
+    async def start(self, accounts: dict):
+        self._running = OTP_WATCHERS_ENABLED
+        self.sync(accounts)
+
+    def sync(self, accounts: dict):
+        """Start watchers for new mailboxes and restart or stop those whose account changed or went away"""
+        if not self._running:
+            return
+        for license_id, watcher in list(self._watchers.items()):
+            account = accounts.get(license_id)
+            if account is None or (account["email"], account["password"]) != (watcher.email, watcher.password):
+                watcher.stop()
+                del self._watchers[license_id]
+        wanted = sorted((license_id for license_id, account in accounts.items() if account.get("email")),
+                        key=_license_number)
+        self._unwatched = 0
+        for license_id in wanted:
+            if license_id in self._watchers:
+                continue
+            if len(self._watchers) >= self.max_watchers:
+                self._unwatched += 1
+                continue
+            account = accounts[license_id]
+            watcher = MailboxWatcher(license_id, account["email"], account["password"])
+            self._watchers[license_id] = watcher
+            watcher.start()
+
+    def _join(self, watchers):
+        for watcher in watchers:
+            watcher.join(timeout=5)
+
+    async def stop(self):
+        self._running = False
+        watchers = list(self._watchers.values())
+        self._watchers = {}
+        for watcher in watchers:
+            watcher.stop()
+        await run_in_threadpool(self._join, watchers)
+
+    def is_watching(self, license_id: str, subject_keyword: str):
+        watcher = self._watchers.get(license_id)
+        return watcher is not None and watcher.connected and watcher.subject_keyword == subject_keyword
+
+    def stats(self):
+        return {
+            "max_watchers": self.max_watchers,
+            "unwatched": self._unwatched,
+            "watchers": {license_id: {"connected": watcher.connected} for license_id, watcher in self._watchers.items()}
+        }
+
+
+otp_watchers = OtpWatcherManager()
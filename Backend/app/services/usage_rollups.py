@@ -0,0 +1,76 @@
+import logging
+from pymongo import UpdateOne
+from app.database import get_db
+from app.utils.time_utils import parse_utc
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("hour", "day")
+
+
+def get_rollup_collection():
+    return get_db()["usage_rollups"]
+
+
+def bucket_start(timestamp, granularity: str):
+    timestamp = parse_utc(timestamp)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rollup_key(granularity: str, bucket, action, user_id, license_id):
+    # Field order matters: the backfill CLI builds the same _id in $group
+    return {
+        "granularity": granularity,
+        "bucket": bucket,
+        "action": action,
+        "user_id": user_id,
+        "license_id": license_id,
+    }
+
+
+def rollup_operations(log_entries: list):
+    """Fold log entries into one $inc upsert per (granularity, bucket, action, user, license)"""
+    totals = {}
+    for entry in log_entries:
+        for granularity in GRANULARITIES:
+            key = rollup_key(
+                granularity,
+                bucket_start(entry["timestamp"], granularity),
+                entry.get("action"),
+                entry.get("user_id"),
+                entry.get("license_id"),
+            )
+            hashable = tuple(key.values())
+            if hashable not in totals:
+                totals[hashable] = {"key": key, "count": 0, "total_duration": 0}
+            total = totals[hashable]
+            total["count"] += 1
+            total["total_duration"] += entry.get("duration_seconds") or 0
+            total["user_name"] = entry.get("user_name")
+            total["license_no"] = entry.get("license_no")
+
+    return [
+        UpdateOne(
+            {"_id": total["key"]},
+            {
+                "$inc": {"count": total["count"], "total_duration": total["total_duration"]},
+                "$set": {"user_name": total["user_name"], "license_no": total["license_no"]},
+                "$setOnInsert": total["key"],
+            },
+            upsert=True,
+        )
+        for total in totals.values()
+    ]
+
+
+async def apply_rollups(log_entries: list):
+    """Add freshly written log entries to the hourly and daily rollups"""
+    operations = rollup_operations(log_entries)
+    if not operations:
+        return
+    try:
+        await get_rollup_collection().bulk_write(operations, ordered=False)
+    except Exception:
+        logger.exception("Failed to update usage rollups for %d log entries", len(log_entries))
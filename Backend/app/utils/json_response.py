@@ -0,0 +1,29 @@
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Encode raw Mongo documents as JSON. ObjectIds become their hex string
+    and datetimes are written natively by orjson in the same isoformat
+    shape FastAPI's encoder produced.
+    """
+    return orjson.dumps(content, default=_default)
+
+
+class MongoJSONResponse(JSONResponse):
+    """
+    Response for route results holding BSON-decoded documents. Returning
+    it directly skips FastAPI's jsonable_encoder pass, so the documents
+    need no per-field rewriting first.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,28 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key onto one in-flight task.
+    Callers that arrive while it runs await the same result (or exception).
+    The shared task keeps running if the caller that started it goes away.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"in_flight": len(self._calls), "calls": self.calls, "coalesced": self.coalesced}
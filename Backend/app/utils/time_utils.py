@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+
+def utcnow():
+    """Current UTC time at BSON's millisecond precision, so what we write reads back unchanged"""
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+def parse_utc(value):
+    """
+    Normalize a stored timestamp to an aware UTC datetime. Accepts native
+    datetimes and the legacy ISO strings (with or without a trailing Z),
+    which are still around until the datetime migration has run.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+def to_iso(value):
+    """Render a timestamp in the API's wire format, e.g. 2025-07-18T12:00:00.000000Z"""
+    if value is None:
+        return None
+    return parse_utc(value).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
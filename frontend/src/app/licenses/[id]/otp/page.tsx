@@ -16,11 +16,12 @@ import {
 
 import getUser from '@/libs/getUser';
 import getLicense from '@/libs/getLicense';
+import getLicenseCredentials from '@/libs/getLicenseCredentials';
 import activateLicense from '@/libs/activateLicense';
 import getOtp from '@/libs/getOtp';
 import extendLicense from '@/libs/extendLicense';
 import releaseLicense from '@/libs/releaseLicense';
-import refreshOtp from '@/libs/refreshOtp';
+import waitOtp from '@/libs/waitOtp';
 import { OtpData } from '@/types/otp';
 import { LicenseData } from '@/types/license';
 
@@ -66,7 +67,9 @@ export default function OtpPage({ params }: { params: Promise<{ id: string }> })
           }
         }
 
-        if (licenseJson.gmail) {
+        // The mailbox address is only served to the holder, which activation just made us
+        const credentials = await getLicenseCredentials(licenseId, token);
+        if (credentials.gmail) {
           if (!licenseJson.No) {
             throw new Error('License number not found');
           }
@@ -165,8 +168,10 @@ export default function OtpPage({ params }: { params: Promise<{ id: string }> })
     setRefreshing(true);
     try {
       if (!licenseData?.No) throw new Error('License number not found');
-      const otpJson: OtpData = await refreshOtp(licenseData.No);
-      setOtpData(otpJson);
+      const otpJson: OtpData = await waitOtp(licenseData.No, otpData?.timestamp);
+      if (otpJson.otp) {
+        setOtpData(otpJson);
+      }
     } catch (err: unknown) {
       const errorMessage = err instanceof Error ? err.message : 'Failed to refresh OTP';
       setError(errorMessage);
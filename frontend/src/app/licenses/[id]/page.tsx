@@ -7,6 +7,7 @@ import { Eye, EyeOff, Copy, Check, ArrowLeft, Mail, Key, Shield, User, RefreshCw
 import { LicenseDetails } from '@/types/license';
 import getUser from '@/libs/getUser';
 import getLicense from '@/libs/getLicense';
+import getLicenseCredentials from '@/libs/getLicenseCredentials';
 import releaseLicense from '@/libs/releaseLicense';
 
 export default function LicenseDetailsPage({ params }: { params: Promise<{ id: string }> }) {
@@ -95,7 +96,13 @@ export default function LicenseDetailsPage({ params }: { params: Promise<{ id: s
           return;
         }
         
-        setLicenseDetails(data);
+        // Mailbox credentials are only served to the admin or the license holder
+        if (isAdmin || isCurrentUser || isReservedByUser) {
+          const credentials = await getLicenseCredentials(licenseId, token);
+          setLicenseDetails({ ...data, ...credentials });
+        } else {
+          setLicenseDetails(data);
+        }
       } catch (err: unknown) {
         const errorMessage = err instanceof Error ? err.message : 'Failed to fetch license details';
         setError(errorMessage);
@@ -7,9 +7,8 @@ import Navbar from '@/components/Navbar';
 import 'react-datepicker/dist/react-datepicker.css';
 import { format } from 'date-fns';
 import CustomDatePicker from '@/components/DatePicker/DatePicker';
-import { License } from '@/types/license';
+import { License, LicenseEvent } from '@/types/license';
 import { UserInfo } from '@/types/user';
-import cleanupExpired from '@/libs/cleanupExpired';
 import getUser from '@/libs/getUser';
 import getLicenses from '@/libs/getLicenses';
 import requestLicense from '@/libs/requestLicense';
@@ -17,6 +16,20 @@ import releaseLicense from '@/libs/releaseLicense';
 import cancelReservation from '@/libs/cancelReservation';
 import downloadLogs from '@/libs/downloadLogs';
 
+function applyLicenseEvent(licenses: License[], event: LicenseEvent): License[] {
+  if (event.type === 'delete') {
+    return licenses.filter(license => license._id !== event.license_id);
+  }
+  if (!licenses.some(license => license._id === event.license_id)) {
+    return event.type === 'insert'
+      ? [...licenses, { _id: event.license_id, ...event.fields } as License]
+      : licenses;
+  }
+  return licenses.map(license =>
+    license._id === event.license_id ? { ...license, ...event.fields } : license
+  );
+}
+
 export default function LicenseManagementDashboard() {
   const [licenses, setLicenses] = useState<License[]>([]);
   const [userInfo, setUserInfo] = useState<UserInfo | null>(null);
@@ -26,6 +39,7 @@ export default function LicenseManagementDashboard() {
   const [filterStatus, setFilterStatus] = useState<'all' | 'available' | 'in-use' | 'queued'>('all');
   const [isRefreshing, setIsRefreshing] = useState(false);
   const [isPageVisible, setIsPageVisible] = useState(true);
+  const [isStreamConnected, setIsStreamConnected] = useState(false);
   const [requestingLicense, setRequestingLicense] = useState<string | null>(null);
   const [cancelingLicense, setCancelingLicense] = useState<string | null>(null);
   const [releasingLicense, setReleasingLicense] = useState<string | null>(null);
@@ -47,14 +61,6 @@ export default function LicenseManagementDashboard() {
         setConnectionStatus('checking');
       }
       
-      if (!isAutoRefresh) {
-        try {
-          await cleanupExpired();
-        } catch (err) {
-          console.warn('Failed to cleanup expired licenses:', err);
-        }
-      }
-      
       const licensesData = await getLicenses();
       setLicenses(licensesData);
       setConnectionStatus('connected');
@@ -82,14 +88,29 @@ export default function LicenseManagementDashboard() {
     fetchData();
   }, []);
 
+  useEffect(() => {
+    const source = new EventSource(`${process.env.NEXT_PUBLIC_API_BASE_URL}/licenses/events`);
+    source.onopen = () => {
+      setIsStreamConnected(true);
+      fetchLicenses(true);
+    };
+    source.onerror = () => setIsStreamConnected(false);
+    source.addEventListener('license', (message) => {
+      const event: LicenseEvent = JSON.parse((message as MessageEvent).data);
+      setLicenses(prev => applyLicenseEvent(prev, event));
+    });
+    source.addEventListener('reset', () => fetchLicenses(true));
+    return () => source.close();
+  }, []);
+
   useEffect(() => {
     const interval = setInterval(() => {
-      if (isPageVisible) {
+      if (isPageVisible && !isStreamConnected) {
         fetchLicenses(true);
       }
     }, 5000);
     return () => clearInterval(interval);
-  }, [isPageVisible]);
+  }, [isPageVisible, isStreamConnected]);
 
   useEffect(() => {
     const handleVisibilityChange = () => {
@@ -477,7 +498,6 @@ export default function LicenseManagementDashboard() {
                     </div>
                     <div>
                       <h3 className="font-semibold text-gray-900 text-lg">{license.username}</h3>
-                      <p className="text-sm text-gray-600">{license.gmail}</p>
                     </div>
                   </div>
                   <div className="flex items-center space-x-2">
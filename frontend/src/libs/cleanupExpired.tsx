@@ -1,18 +0,0 @@
-'use server'
-
-export default async function cleanupExpired() {
-  const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL;
-  const response = await fetch(`${API_BASE_URL}/licenses/cleanup-expired`, {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json'
-    }
-  });
-  
-  if (!response.ok) {
-    const errorData = await response.json().catch(() => ({}));
-    throw new Error(errorData.detail || 'Failed to cleanup expired licenses');
-  }
-  
-  return await response.json();
-}
\ No newline at end of file
@@ -0,0 +1,14 @@
+'use server'
+
+export default async function getLicenseCredentials(licenseId: string, token: string) {
+  const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL;
+  const response = await fetch(`${API_BASE_URL}/licenses/${licenseId}/credentials`, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+
+  if (!response.ok) {
+    throw new Error(`License credentials fetch error: ${response.status}`);
+  }
+
+  return await response.json();
+}
\ No newline at end of file
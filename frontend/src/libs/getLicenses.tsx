@@ -2,12 +2,24 @@
 
 export default async function getLicenses() {
   const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL;
-  const response = await fetch(`${API_BASE_URL}/licenses`);
-  
-  if (!response.ok) {
-    throw new Error(`Failed to fetch licenses: ${response.status}`);
-  }
-  
-  const data = await response.json();
-  return data.licensess || [];
+  const licenses = [];
+  let cursor: string | null = null;
+
+  do {
+    const params = new URLSearchParams({ limit: '500' });
+    if (cursor) {
+      params.set('cursor', cursor);
+    }
+    const response = await fetch(`${API_BASE_URL}/licenses/lean?${params.toString()}`);
+
+    if (!response.ok) {
+      throw new Error(`Failed to fetch licenses: ${response.status}`);
+    }
+
+    const data = await response.json();
+    licenses.push(...(data.licensess || []));
+    cursor = data.next_cursor;
+  } while (cursor);
+
+  return licenses;
 }
\ No newline at end of file
@@ -0,0 +1,18 @@
+'use server'
+
+export default async function waitOtp(licenseNo: string, after?: string) {
+  const API_BASE_URL = process.env.NEXT_PUBLIC_API_BASE_URL;
+  const licenseKey = `license${parseInt(licenseNo, 10)}`;
+  const params = new URLSearchParams({ license_id: licenseKey });
+  if (after) {
+    params.set('after', after);
+  }
+
+  const response = await fetch(`${API_BASE_URL}/otp/wait?${params.toString()}`, { cache: 'no-store' });
+
+  if (!response.ok) {
+    throw new Error(`OTP wait error: ${response.status}`);
+  }
+
+  return await response.json();
+}
\ No newline at end of file
@@ -3,7 +3,7 @@ export interface License {
   No: string;
   username: string;
   password?: string;
-  gmail: string;
+  gmail?: string;
   mail_password?: string;
   is_available?: boolean;
   current_user?: string;
@@ -17,6 +17,13 @@ export interface License {
   last_activity?: string;
 }
 
+export interface LicenseEvent {
+  id: string;
+  type: 'insert' | 'update' | 'delete';
+  license_id: string;
+  fields?: Partial<License>;
+}
+
 export interface LicenseData {
   _id: string;
   No: string;
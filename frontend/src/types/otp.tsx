@@ -4,5 +4,6 @@ export interface OtpData {
   from: string;
   subject: string;
   date: string;
+  timestamp?: string;
   license_id?: string;
 }
\ No newline at end of file